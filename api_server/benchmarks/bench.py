@@ -0,0 +1,255 @@
+## ingest / query / upload benchmarks against local stand-ins
+# runs the FastAPI app in process over an ASGI transport, with mongomock-motor (or a real mongod via --mongodb-url)
+# for MongoDB and moto for S3, and writes the results as JSON so runs on different commits can be compared
+#
+#   poetry install --with dev
+#   python benchmarks/bench.py                                  # writes benchmarks/results/<commit>.json
+#   python benchmarks/bench.py --compare benchmarks/results/<older commit>.json
+#
+# absolute numbers against mongomock mostly measure the application code, compare runs made on the same machine only
+
+import argparse
+import asyncio
+import contextlib
+import datetime
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import time
+
+API_SERVER_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+RESULTS_DIR = os.path.join(API_SERVER_DIR, "benchmarks", "results")
+sys.path.insert(0, API_SERVER_DIR)
+
+BENCH_ENV = {
+    "AWS_ACCESS_KEY_ID": "bench",
+    "AWS_SECRET_ACCESS_KEY": "bench",
+    "AWS_BUCKET_REGION": "us-east-1",
+    "AWS_BUCKET_NAME": "roomsense2-bench",
+    "MONGODB_CONNECTION_STRING": "mongodb://localhost:27017",
+    "MONGODB_DB_NAME": "roomsense2_bench",
+    "MONGODB_DEVICES_COLLECTION_NAME": "Devices",
+    "MONGODB_LOGS_COLLECTION_NAME": "Logs",
+}
+BASE_TIMESTAMP = datetime.datetime(2024, 1, 1)
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="roomsense2 api server benchmarks")
+    parser.add_argument("--output", help="results file, defaults to benchmarks/results/<commit>.json")
+    parser.add_argument("--compare", help="earlier results file to print relative changes against")
+    parser.add_argument("--mongodb-url", help="benchmark against a real mongod instead of mongomock (its database is dropped)")
+    parser.add_argument("--ingest-requests", type=int, default=2000)
+    parser.add_argument("--ingest-concurrency", type=int, nargs="+", default=[1, 16])
+    parser.add_argument("--seed-logs", type=int, default=5000, help="logs stored before the page benchmarks")
+    parser.add_argument("--page-depths", type=int, nargs="+", default=[0, 1000, 4000])
+    parser.add_argument("--page-sizes", type=int, nargs="+", default=[10, 50, 500])
+    parser.add_argument("--page-repeats", type=int, default=20)
+    parser.add_argument("--upload-sizes-kib", type=int, nargs="+", default=[64, 1024, 8192])
+    parser.add_argument("--upload-repeats", type=int, default=10)
+    return parser.parse_args()
+
+
+def git_commit():
+    try:
+        commit = subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=API_SERVER_DIR, capture_output=True, text=True, check=True).stdout.strip()
+        dirty = subprocess.run(["git", "status", "--porcelain", "--", "."], cwd=API_SERVER_DIR, capture_output=True, text=True, check=True).stdout.strip() != ""
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown", False
+    return commit, dirty
+
+def summarize(samples:list[float]):
+    ordered = sorted(samples)
+    return {
+        "n": len(ordered),
+        "meanMs": statistics.fmean(ordered) * 1000,
+        "p50Ms": ordered[len(ordered) // 2] * 1000,
+        "p95Ms": ordered[min(len(ordered) - 1, int(len(ordered) * 0.95))] * 1000,
+        "maxMs": ordered[-1] * 1000,
+    }
+
+def log_payload(index:int, device_count:int = 20):
+    return {
+        "timestamp": (BASE_TIMESTAMP + datetime.timedelta(seconds=index)).isoformat(),
+        "metadata": {"device": f"bench-{index % device_count}", "sensor": "scd41"},
+        "data": {"co2": 400 + index % 600, "humidity": 40 + index % 20, "temperature": 20 + index % 8}
+    }
+
+# the app prints every query and insert, which would dominate the timings
+@contextlib.contextmanager
+def quiet():
+    with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+        yield
+
+
+# app from the factory with its lifespan running, api_version() reads pyproject.toml from the working directory
+@contextlib.asynccontextmanager
+async def serve_app(args):
+    os.chdir(API_SERVER_DIR)
+    from roomsense2.app import create_app
+
+    if args.mongodb_url is not None:
+        import motor.motor_asyncio
+        mongodb_client = motor.motor_asyncio.AsyncIOMotorClient(args.mongodb_url)
+    else:
+        from mongomock_motor import AsyncMongoMockClient
+        mongodb_client = AsyncMongoMockClient()
+    app = create_app(BENCH_ENV, mongodb_client)
+    with quiet():
+        async with app.router.lifespan_context(app):
+            app.state.s3_interface.client.create_bucket(Bucket=BENCH_ENV["AWS_BUCKET_NAME"])
+            yield app
+
+
+async def bench_ingest(client, args):
+    results = list()
+    offset = 0
+    for concurrency in args.ingest_concurrency:
+        samples = list()
+        next_index = offset
+
+        async def worker():
+            nonlocal next_index
+            while next_index < offset + args.ingest_requests:
+                index = next_index
+                next_index += 1
+                start = time.perf_counter()
+                response = await client.post("/update/log", json=log_payload(index))
+                samples.append(time.perf_counter() - start)
+                response.raise_for_status()
+
+        start = time.perf_counter()
+        await asyncio.gather(*[worker() for _ in range(concurrency)])
+        elapsed = time.perf_counter() - start
+        offset += args.ingest_requests
+        results.append({"route": "/update/log", "concurrency": concurrency, "requestsPerSecond": args.ingest_requests / elapsed, "latency": summarize(samples)})
+    return results
+
+async def seed_logs(client, count:int):
+    for start in range(0, count, 1000):
+        batch = [log_payload(index) for index in range(start, min(count, start + 1000))]
+        response = await client.post("/update/logs", json=batch)
+        response.raise_for_status()
+
+# a page at a given depth is fetched both ways: skipping with cursor, and seeking with the pageToken of the document before it
+async def bench_pages(app, client, args):
+    from roomsense2.pagination import log_page_sort, log_page_token
+    mongodb_interface = app.state.mongodb_interface
+    coll = mongodb_interface.database[mongodb_interface.collectionMapping["Logs"]]
+    results = list()
+    for depth in args.page_depths:
+        token = None
+        if depth > 0:
+            previous = await coll.find({}, {"timestamp": 1}).sort(log_page_sort("desc")).skip(depth - 1).limit(1).to_list(1)
+            token = log_page_token(previous[0]["timestamp"], previous[0]["_id"], "desc")
+        for page_size in args.page_sizes:
+            for mode, body in [("cursor", {"cursor": depth}), ("pageToken", {} if token is None else {"pageToken": token})]:
+                samples = list()
+                for _ in range(args.page_repeats):
+                    start = time.perf_counter()
+                    response = await client.post("/v0/log", json={"limit": page_size, **body})
+                    samples.append(time.perf_counter() - start)
+                    response.raise_for_status()
+                returned = len(response.json()["result"]["data"])
+                results.append({"route": "/v0/log", "mode": mode, "depth": depth, "pageSize": page_size, "returned": returned, "latency": summarize(samples)})
+    return results
+
+async def bench_uploads(client, args):
+    results = list()
+    for size_kib in args.upload_sizes_kib:
+        samples = list()
+        for _ in range(args.upload_repeats):
+            # fresh random bytes each time so content addressing never turns an upload into a lookup
+            body = os.urandom(size_kib * 1024)
+            start = time.perf_counter()
+            response = await client.post("/upload/image", files={"file": ("bench.png", body, "image/png")})
+            samples.append(time.perf_counter() - start)
+            response.raise_for_status()
+            if response.json()["status"] != "success":
+                raise RuntimeError(f"upload failed: {response.json()}")
+        results.append({
+            "route": "/upload/image",
+            "sizeKiB": size_kib,
+            "megabytesPerSecond": size_kib / 1024 * len(samples) / sum(samples),
+            "latency": summarize(samples)
+        })
+    return results
+
+
+async def run(args):
+    import httpx
+    from roomsense2.mongodb import ensure_indexes
+
+    async with serve_app(args) as app:
+        mongodb_interface = app.state.mongodb_interface
+        transport = httpx.ASGITransport(app=app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+            with quiet():
+                await mongodb_interface.database.drop_collection(BENCH_ENV["MONGODB_LOGS_COLLECTION_NAME"])
+                await ensure_indexes(mongodb_interface)
+                ingest = await bench_ingest(client, args)
+                await mongodb_interface.database.drop_collection(BENCH_ENV["MONGODB_LOGS_COLLECTION_NAME"])
+                await ensure_indexes(mongodb_interface)
+                await seed_logs(client, args.seed_logs)
+                pages = await bench_pages(app, client, args)
+                uploads = await bench_uploads(client, args)
+    return {"ingest": ingest, "pages": pages, "uploads": uploads}
+
+
+# identifies a measurement across runs
+def result_key(result:dict):
+    return tuple((key, value) for key, value in result.items() if key not in ("latency", "requestsPerSecond", "megabytesPerSecond", "returned"))
+
+def compare(current:dict, previous:dict):
+    print(f"compared with {previous['commit']} ({previous['backend']}), change in p50 latency:")
+    for section in ("ingest", "pages", "uploads"):
+        earlier = {result_key(result): result for result in previous.get(section, [])}
+        for result in current[section]:
+            match = earlier.get(result_key(result))
+            if match is None:
+                continue
+            change = result["latency"]["p50Ms"] / match["latency"]["p50Ms"] - 1
+            label = " ".join(f"{key}={value}" for key, value in result_key(result))
+            print(f"  {label}: {match['latency']['p50Ms']:.2f}ms -> {result['latency']['p50Ms']:.2f}ms ({change:+.1%})")
+
+
+def cli():
+    args = parse_args()
+    commit, dirty = git_commit()
+    from moto import mock_aws
+    with mock_aws():
+        results = asyncio.run(run(args))
+
+    report = {
+        "commit": commit,
+        "dirty": dirty,
+        "createdAt": datetime.datetime.now(datetime.timezone.utc).isoformat(),
+        "python": platform.python_version(),
+        "backend": "mongodb" if args.mongodb_url is not None else "mongomock",
+        "parameters": vars(args),
+        **results
+    }
+    output = args.output
+    if output is None:
+        os.makedirs(RESULTS_DIR, exist_ok=True)
+        output = os.path.join(RESULTS_DIR, f"{commit}{'-dirty' if dirty else ''}.json")
+    with open(output, "w") as results_file:
+        json.dump(report, results_file, indent=2)
+    print(f"wrote {output}")
+
+    for result in report["ingest"]:
+        print(f"ingest concurrency={result['concurrency']}: {result['requestsPerSecond']:.0f} req/s, p50 {result['latency']['p50Ms']:.2f}ms")
+    for result in report["pages"]:
+        print(f"page {result['mode']} depth={result['depth']} size={result['pageSize']}: p50 {result['latency']['p50Ms']:.2f}ms")
+    for result in report["uploads"]:
+        print(f"upload {result['sizeKiB']}KiB: {result['megabytesPerSecond']:.1f} MB/s")
+
+    if args.compare is not None:
+        with open(args.compare) as previous_file:
+            compare(report, json.load(previous_file))
+
+if __name__ == "__main__":
+    cli()
@@ -0,0 +1,199 @@
+from contextlib import asynccontextmanager
+from fastapi import FastAPI
+from pymongo import WriteConcern
+from pymongo.read_preferences import Nearest, Primary, PrimaryPreferred, Secondary, SecondaryPreferred
+from roomsense2.mongodb import MongoDBInterface, ensure_indexes, INGEST_PROFILE, DEVICE_PROFILE, READ_PROFILE
+from roomsense2.s3 import S3Interface
+from roomsense2.media import MediaIndex
+from roomsense2.pubsub import LogBroker
+from roomsense2.cache import TTLCache
+from roomsense2.serialization import api_version
+from roomsense2.metrics import REGISTRY, CallbackMetric, MetricsMiddleware
+from roomsense2.compression import CompressionMiddleware
+from roomsense2.routes import router
+
+## application factory
+# the backend clients are built by the lifespan, i.e. inside every worker process after it was forked,
+# so `gunicorn -k uvicorn.workers.UvicornWorker -w N main:app` (with or without --preload) gives each worker its own pools
+
+# .env key -> motor client option, only keys that are set are passed on
+MONGODB_CLIENT_OPTIONS = {
+    "MONGODB_MAX_POOL_SIZE": "maxPoolSize",
+    "MONGODB_MIN_POOL_SIZE": "minPoolSize",
+    "MONGODB_MAX_IDLE_TIME_MS": "maxIdleTimeMS",
+    "MONGODB_WAIT_QUEUE_TIMEOUT_MS": "waitQueueTimeoutMS",
+    "MONGODB_CONNECT_TIMEOUT_MS": "connectTimeoutMS",
+    "MONGODB_SOCKET_TIMEOUT_MS": "socketTimeoutMS",
+    "MONGODB_SERVER_SELECTION_TIMEOUT_MS": "serverSelectionTimeoutMS",
+}
+
+READ_PREFERENCES = {
+    "primary": Primary,
+    "primaryPreferred": PrimaryPreferred,
+    "secondary": Secondary,
+    "secondaryPreferred": SecondaryPreferred,
+    "nearest": Nearest,
+}
+
+
+def mongodb_client_options(config:dict):
+    return {option: int(config[key]) for key, option in MONGODB_CLIENT_OPTIONS.items() if config.get(key) is not None}
+
+# <prefix>_W is a node count or "majority" (0 for unacknowledged writes), <prefix>_JOURNAL waits for the journal,
+# <prefix>_WTIMEOUT_MS bounds the wait for replication
+def write_concern(config:dict, prefix:str, w:str, journal:str):
+    w = config.get(f"{prefix}_W", w)
+    options = {"w": int(w) if w.isdigit() else w}
+    # unacknowledged writes cannot wait for the journal
+    if options["w"] != 0:
+        options["j"] = config.get(f"{prefix}_JOURNAL", journal).lower() == "true"
+    if config.get(f"{prefix}_WTIMEOUT_MS") is not None:
+        options["wtimeout"] = int(config[f"{prefix}_WTIMEOUT_MS"])
+    return WriteConcern(**options)
+
+# MONGODB_READ_PREFERENCE is a mode name, MONGODB_READ_MAX_STALENESS_SECONDS (90 or more) drops lagging secondaries
+def read_preference(config:dict):
+    mode = config.get("MONGODB_READ_PREFERENCE", "secondaryPreferred")
+    if mode not in READ_PREFERENCES:
+        raise ValueError(f"MONGODB_READ_PREFERENCE must be one of {list(READ_PREFERENCES)}")
+    if mode == "primary":
+        return Primary()
+    return READ_PREFERENCES[mode](max_staleness=int(config.get("MONGODB_READ_MAX_STALENESS_SECONDS", "-1")))
+
+def create_s3_interface(config:dict):
+    max_concurrency = int(config.get("AWS_UPLOAD_CONCURRENCY", "4"))
+    s3_interface = S3Interface(
+        config["AWS_ACCESS_KEY_ID"], config["AWS_SECRET_ACCESS_KEY"],config["AWS_BUCKET_REGION"],
+        max_concurrency=max_concurrency,
+        multipart_threshold=int(config.get("AWS_MULTIPART_THRESHOLD_MB", "8")) * 1024 * 1024,
+        endpoint_url=config.get("AWS_ENDPOINT_URL"),
+        # every upload worker can run a multipart transfer, give them room beyond botocore's default of 10
+        max_pool_connections=int(config.get("AWS_MAX_POOL_CONNECTIONS", str(max(10, max_concurrency * 4)))),
+        connect_timeout=float(config.get("AWS_CONNECT_TIMEOUT_SECONDS", "60")),
+        read_timeout=float(config.get("AWS_READ_TIMEOUT_SECONDS", "60"))
+    )
+    s3_interface.set_collection_mapping("Images", config["AWS_BUCKET_NAME"] )
+    s3_interface.set_collection_mapping("Audios", config["AWS_BUCKET_NAME"] )
+    return s3_interface
+
+def create_mongodb_interface(config:dict, client = None):
+    mongodb_interface = MongoDBInterface(config["MONGODB_CONNECTION_STRING"], config["MONGODB_DB_NAME"], client, **mongodb_client_options(config))
+    mongodb_interface.set_collection_mapping("Devices", config["MONGODB_DEVICES_COLLECTION_NAME"])
+    mongodb_interface.set_collection_mapping("Logs", config["MONGODB_LOGS_COLLECTION_NAME"])
+    # logs are acknowledged by the primary alone, devices once a majority has them journaled,
+    # retrieval routes prefer secondaries (they may lag the primary slightly), device reads refilling the
+    # device cache right after a device write go to the primary
+    mongodb_interface.set_profile(INGEST_PROFILE, write_concern=write_concern(config, "MONGODB_INGEST", "1", "false"))
+    mongodb_interface.set_profile(DEVICE_PROFILE, write_concern=write_concern(config, "MONGODB_DEVICE", "majority", "true"), read_preference=Primary())
+    mongodb_interface.set_profile(READ_PROFILE, read_preference=read_preference(config))
+    # optional write-behind buffer for /update/log, e.g. MONGODB_LOG_BUFFER_SIZE=500 MONGODB_LOG_BUFFER_DELAY_MS=50
+    if config.get("MONGODB_LOG_BUFFER_SIZE") is not None:
+        mongodb_interface.enable_log_buffer(
+            int(config["MONGODB_LOG_BUFFER_SIZE"]),
+            int(config.get("MONGODB_LOG_BUFFER_DELAY_MS", "50")) / 1000
+        )
+    # optional rollup collections (1 min / 1 h / 1 day) maintained on ingest, MONGODB_ROLLUPS=true.
+    # buckets are merged across requests and written every MONGODB_ROLLUP_BUFFER_DELAY_MS or once
+    # MONGODB_ROLLUP_BUFFER_SIZE buckets are pending
+    if config.get("MONGODB_ROLLUPS", "false").lower() == "true":
+        mongodb_interface.set_collection_mapping("RollupsMinute", config.get("MONGODB_ROLLUPS_MINUTE_COLLECTION_NAME", "LogsRollupMinute"))
+        mongodb_interface.set_collection_mapping("RollupsHour", config.get("MONGODB_ROLLUPS_HOUR_COLLECTION_NAME", "LogsRollupHour"))
+        mongodb_interface.set_collection_mapping("RollupsDay", config.get("MONGODB_ROLLUPS_DAY_COLLECTION_NAME", "LogsRollupDay"))
+        mongodb_interface.enable_rollups(
+            int(config.get("MONGODB_ROLLUP_BUFFER_SIZE", "1000")),
+            int(config.get("MONGODB_ROLLUP_BUFFER_DELAY_MS", "1000")) / 1000
+        )
+    # optional device lookup/page cache, e.g. DEVICE_CACHE_SIZE=1024 DEVICE_CACHE_TTL_SECONDS=30,
+    # refilled from the primary for DEVICE_CACHE_PRIMARY_SECONDS after a device write.
+    # a write only clears the cache of the worker that handled it, other workers serve the old device for up to
+    # DEVICE_CACHE_TTL_SECONDS unless MONGODB_CHANGE_STREAM=true, which clears every worker's cache on each Devices change
+    # page counts are cached per filter for COUNT_CACHE_TTL_SECONDS
+    mongodb_interface.countCache = TTLCache(1024, float(config.get("COUNT_CACHE_TTL_SECONDS", "10")))
+    if config.get("DEVICE_CACHE_SIZE") is not None:
+        mongodb_interface.enable_device_cache(
+            int(config["DEVICE_CACHE_SIZE"]),
+            float(config.get("DEVICE_CACHE_TTL_SECONDS", "30")),
+            float(config.get("DEVICE_CACHE_PRIMARY_SECONDS", "10"))
+        )
+    # latest readings are reloaded from mongodb every SNAPSHOT_REFRESH_SECONDS when set (needed with several workers),
+    # by a background task the lifespan starts, requests keep serving the current table meanwhile
+    mongodb_interface.latestReadingsRefresh = float(config.get("SNAPSHOT_REFRESH_SECONDS", "0"))
+    # live subscriptions, bounded per-subscriber queues. MONGODB_CHANGE_STREAM=true feeds them (and the latest readings)
+    # from a change stream on Logs so inserts handled by other workers are pushed too
+    mongodb_interface.logBroker = LogBroker(
+        int(config.get("SUBSCRIPTION_QUEUE_SIZE", "100")),
+        int(config.get("SUBSCRIPTION_MAX_SUBSCRIBERS", "1000"))
+    )
+    if config.get("MONGODB_CHANGE_STREAM", "false").lower() == "true":
+        mongodb_interface.enable_change_stream()
+    return mongodb_interface
+
+# optional content addressed media index, duplicate uploads return the stored link without touching S3
+def attach_media_index(config:dict, mongodb_interface:MongoDBInterface, s3_interface:S3Interface):
+    if config.get("MONGODB_MEDIA_COLLECTION_NAME") is not None:
+        mongodb_interface.set_collection_mapping("Media", config["MONGODB_MEDIA_COLLECTION_NAME"])
+        s3_interface.set_media_index(MediaIndex(mongodb_interface, int(config.get("MEDIA_INDEX_CACHE_SIZE", "4096"))))
+
+
+# cache and subscription state of the serving app, read at scrape time
+def register_state_metrics(app:FastAPI):
+    def cache_stats():
+        mongodb_interface = getattr(app.state, "mongodb_interface", None)
+        s3_interface = getattr(app.state, "s3_interface", None)
+        if mongodb_interface is None:
+            return dict()
+        caches = {"count": mongodb_interface.countCache, "device": mongodb_interface.deviceCache}
+        if s3_interface is not None and s3_interface.mediaIndex is not None:
+            caches["media"] = s3_interface.mediaIndex.cache
+        return {name: cache.stats() for name, cache in caches.items() if cache is not None}
+
+    def subscribers():
+        mongodb_interface = getattr(app.state, "mongodb_interface", None)
+        if mongodb_interface is None:
+            return dict()
+        return {(): len(mongodb_interface.logBroker.subscriptions)}
+
+    for stat, suffix, kind in [("hits", "total", "counter"), ("misses", "total", "counter"), ("evictions", "total", "counter"), ("size", "entries", "gauge")]:
+        REGISTRY.register(CallbackMetric(
+            f"roomsense2_cache_{stat}_{suffix}", f"Cache {stat} by cache", ("cache",),
+            lambda stat=stat: {(name,): stats[stat] for name, stats in cache_stats().items()},
+            kind
+        ))
+    REGISTRY.register(CallbackMetric("roomsense2_subscribers", "Live log subscriptions", (), subscribers))
+
+
+# config holds the .env values, mongodb_client replaces the motor client built from it (e.g. a stand-in for benchmarks)
+def create_app(config:dict, mongodb_client = None):
+    api_version() # read once at startup, cached for every response
+
+    @asynccontextmanager
+    async def lifespan(app:FastAPI):
+        mongodb_interface = create_mongodb_interface(config, mongodb_client)
+        s3_interface = create_s3_interface(config)
+        attach_media_index(config, mongodb_interface, s3_interface)
+        app.state.mongodb_interface = mongodb_interface
+        app.state.s3_interface = s3_interface
+        await ensure_indexes(mongodb_interface, config.get("MONGODB_LOGS_TIMESERIES", "false").lower() == "true")
+        mongodb_interface.start_change_stream()
+        mongodb_interface.start_latest_readings_refresh()
+        try:
+            yield
+        finally:
+            await mongodb_interface.close()
+            s3_interface.close()
+
+    app = FastAPI(lifespan=lifespan)
+    app.state.config = config
+    # gzip / zstd bodies, responses below COMPRESSION_MIN_SIZE bytes are sent as they are.
+    # added before the metrics middleware so that one wraps it and records the sizes on the wire
+    app.add_middleware(
+        CompressionMiddleware,
+        min_size=int(config.get("COMPRESSION_MIN_SIZE", "1024")),
+        gzip_level=int(config.get("COMPRESSION_GZIP_LEVEL", "6")),
+        zstd_level=int(config.get("COMPRESSION_ZSTD_LEVEL", "3")),
+        max_request_size=int(config.get("MAX_REQUEST_BODY_MB", "16")) * 1024 * 1024
+    )
+    app.add_middleware(MetricsMiddleware)
+    app.include_router(router)
+    register_state_metrics(app)
+    return app
@@ -0,0 +1,48 @@
+import copy
+import time
+from collections import OrderedDict
+from typing import Any, Hashable
+
+# in-process cache with a time to live per entry and least recently used eviction
+# values are copied on the way in and out so callers can never mutate a cached entry
+class TTLCache:
+
+    def __init__(self, max_size:int = 1024, ttl:float = 30.0):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.entries: OrderedDict[Hashable, tuple[float, Any]] = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    # returns None on a miss, None values are therefore never cached
+    def get(self, key:Hashable):
+        entry = self.entries.get(key)
+        if entry is None or entry[0] < time.monotonic():
+            if entry is not None:
+                del self.entries[key]
+            self.misses += 1
+            return None
+        self.entries.move_to_end(key)
+        self.hits += 1
+        return copy.deepcopy(entry[1])
+
+    def set(self, key:Hashable, value:Any):
+        if value is None:
+            return
+        self.entries[key] = (time.monotonic() + self.ttl, copy.deepcopy(value))
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.max_size:
+            self.entries.popitem(last=False)
+            self.evictions += 1
+
+    def clear(self):
+        self.entries.clear()
+
+    def stats(self):
+        return {
+            "size": len(self.entries),
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions
+        }
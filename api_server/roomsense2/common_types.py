@@ -1,6 +1,10 @@
+import base64
+import binascii
 import datetime
-from pydantic import BaseModel
+from bson import Binary
+from pydantic import BaseModel, model_validator
 from typing import Optional
+from roomsense2.ir import IR_FRAME_SCALE, frame_in_range, pack_frame
 
 
 class HumidityTemperature(BaseModel):
@@ -33,12 +37,35 @@ class Brightness(BaseModel):
             "brightness": self.brightness
         }
     
+# accepts either the frame as a list of temperatures or already packed (base64 little-endian int16 centi-degrees)
+# and is always stored packed, see roomsense2.ir
 class IRImage(BaseModel):
-    frame: list[float]
+    frame: Optional[list[float]] = None
+    framePacked: Optional[str] = None
+
+    @model_validator(mode="after")
+    def check_frame(self):
+        if (self.frame is None) == (self.framePacked is None):
+            raise ValueError("exactly one of frame or framePacked is required")
+        if self.frame is not None and not frame_in_range(self.frame):
+            raise ValueError("frame values must be finite and within -327.68..327.67")
+        if self.framePacked is not None:
+            try:
+                packed = base64.b64decode(self.framePacked, validate=True)
+            except binascii.Error:
+                raise ValueError("framePacked is not valid base64")
+            if len(packed) % 2 != 0:
+                raise ValueError("framePacked must hold int16 values")
+        return self
 
     def to_dict(self):
+        if self.framePacked is not None:
+            packed = base64.b64decode(self.framePacked)
+        else:
+            packed = pack_frame(self.frame)
         return {
-            "frame": self.frame
+            "framePacked": Binary(packed),
+            "frameScale": IR_FRAME_SCALE
         }
 
     
@@ -0,0 +1,194 @@
+import functools
+import json
+import zlib
+import anyio.to_thread
+
+try:
+    import zstandard
+except ImportError:  # zstandard is optional, only gzip is offered and accepted without it
+    zstandard = None
+
+## compressed request and response bodies
+# ingest routes accept gzip / zstd encoded bodies (Content-Encoding), retrieval routes compress
+# their response with the best encoding the client accepts (Accept-Encoding)
+
+REQUEST_DECOMPRESSION_PREFIXES = ("/update/",)
+RESPONSE_COMPRESSION_PREFIXES = ("/v0/",)
+# preferred first when the client accepts several with the same weight
+RESPONSE_ENCODINGS = ("zstd", "gzip")
+DECOMPRESS_CHUNK_SIZE = 64 * 1024
+# bodies from this size on are (de)compressed in the threadpool instead of on the event loop
+THREADPOOL_MIN_SIZE = 64 * 1024
+
+
+def supported_encodings():
+    return [encoding for encoding in RESPONSE_ENCODINGS if encoding != "zstd" or zstandard is not None]
+
+# most preferred supported encoding of an Accept-Encoding header, None when the client accepts none of them
+def negotiate_encoding(accept_encoding:str):
+    weights = dict()
+    for item in accept_encoding.split(","):
+        name, _, params = item.strip().partition(";")
+        weight = 1.0
+        params = params.strip()
+        if params.startswith("q="):
+            try:
+                weight = float(params[2:])
+            except ValueError:
+                weight = 0.0
+        weights[name.strip().lower()] = weight
+
+    best, best_weight = None, 0.0
+    for encoding in supported_encodings():
+        weight = weights.get(encoding, weights.get("*", 0.0))
+        if weight > best_weight:
+            best, best_weight = encoding, weight
+    return best
+
+def compress(body:bytes, encoding:str, gzip_level:int, zstd_level:int):
+    if encoding == "zstd":
+        return zstandard.ZstdCompressor(level=zstd_level).compress(body)
+    compressor = zlib.compressobj(gzip_level, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+    return compressor.compress(body) + compressor.flush()
+
+# None once the body inflates beyond max_size bytes, raises ValueError for corrupt bodies
+def decompress(body:bytes, encoding:str, max_size:int):
+    if encoding == "zstd":
+        reader = zstandard.ZstdDecompressor().stream_reader(body)
+        chunks = list()
+        size = 0
+        try:
+            while size <= max_size:
+                chunk = reader.read(min(DECOMPRESS_CHUNK_SIZE, max_size + 1 - size))
+                if len(chunk) == 0:
+                    break
+                chunks.append(chunk)
+                size += len(chunk)
+        except zstandard.ZstdError as e:
+            raise ValueError(str(e))
+        data = b"".join(chunks)
+    else:
+        decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS)
+        try:
+            data = decompressor.decompress(body, max_size + 1)
+        except zlib.error as e:
+            raise ValueError(str(e))
+        if len(data) <= max_size and not decompressor.eof:
+            raise ValueError("truncated gzip body")
+    if len(data) > max_size:
+        return None
+    return data
+
+# compress / decompress, offloaded to a worker thread for large bodies so they never stall other requests
+async def run_codec(codec, body:bytes, *args):
+    if len(body) < THREADPOOL_MIN_SIZE:
+        return codec(body, *args)
+    return await anyio.to_thread.run_sync(functools.partial(codec, body, *args))
+
+
+async def send_error(send, status:int, detail:str):
+    body = json.dumps({"detail": detail}).encode()
+    await send({"type": "http.response.start", "status": status, "headers": [(b"content-type", b"application/json"), (b"content-length", str(len(body)).encode())]})
+    await send({"type": "http.response.body", "body": body})
+
+
+# ASGI middleware, responses are only compressed when the app sends them as one message of at least min_size bytes,
+# streamed responses (NDJSON export, server-sent events) pass through untouched
+class CompressionMiddleware:
+
+    def __init__(self, app, min_size:int = 1024, gzip_level:int = 6, zstd_level:int = 3, max_request_size:int = 16 * 1024 * 1024):
+        self.app = app
+        self.min_size = min_size
+        self.gzip_level = gzip_level
+        self.zstd_level = zstd_level
+        self.max_request_size = max_request_size
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+
+        path = scope["path"]
+        headers = dict(scope["headers"])
+        content_encoding = headers.get(b"content-encoding", b"identity").decode().strip().lower()
+        if content_encoding != "identity" and path.startswith(REQUEST_DECOMPRESSION_PREFIXES):
+            if content_encoding not in supported_encodings():
+                return await send_error(send, 415, f"unsupported content encoding {content_encoding}")
+            body = await self.read_body(receive)
+            if body is None:
+                return await send_error(send, 413, "request body too large")
+            try:
+                body = await run_codec(decompress, body, content_encoding, self.max_request_size)
+            except ValueError:
+                return await send_error(send, 400, f"invalid {content_encoding} body")
+            if body is None:
+                return await send_error(send, 413, "request body too large")
+            # updated in place, the route the router sets on the scope has to reach the metrics middleware
+            scope["headers"] = [(name, value) for name, value in scope["headers"] if name not in (b"content-encoding", b"content-length")]
+            scope["headers"].append((b"content-length", str(len(body)).encode()))
+            receive = self.replay(body, receive)
+
+        encoding = None
+        if path.startswith(RESPONSE_COMPRESSION_PREFIXES):
+            encoding = negotiate_encoding(headers.get(b"accept-encoding", b"").decode())
+        if encoding is None:
+            return await self.app(scope, receive, send)
+        await self.app(scope, receive, self.compressing_send(send, encoding))
+
+    # whole request body, None once it exceeds max_request_size (compressed)
+    async def read_body(self, receive):
+        chunks = list()
+        size = 0
+        while True:
+            message = await receive()
+            if message["type"] == "http.disconnect":
+                return b""
+            chunks.append(message.get("body", b""))
+            size += len(chunks[-1])
+            if size > self.max_request_size:
+                return None
+            if not message.get("more_body", False):
+                return b"".join(chunks)
+
+    # hands the decompressed body to the app, then forwards later messages (disconnect) from the server
+    def replay(self, body:bytes, receive):
+        sent = False
+
+        async def replayed_receive():
+            nonlocal sent
+            if not sent:
+                sent = True
+                return {"type": "http.request", "body": body, "more_body": False}
+            return await receive()
+
+        return replayed_receive
+
+    def compressing_send(self, send, encoding:str):
+        start_message = None
+        passthrough = False
+
+        async def wrapped_send(message):
+            nonlocal start_message, passthrough
+            if passthrough or message["type"] not in ("http.response.start", "http.response.body"):
+                return await send(message)
+            if message["type"] == "http.response.start":
+                headers = dict(message.get("headers", []))
+                if b"content-encoding" in headers or headers.get(b"content-type", b"").startswith(b"text/event-stream"):
+                    passthrough = True
+                    return await send(message)
+                # held back until the first body message shows whether the response is sent in one piece
+                start_message = message
+                return
+
+            passthrough = True
+            body = message.get("body", b"")
+            if message.get("more_body", False) or len(body) < self.min_size:
+                await send(start_message)
+                return await send(message)
+
+            body = await run_codec(compress, body, encoding, self.gzip_level, self.zstd_level)
+            response_headers = [(name, value) for name, value in start_message.get("headers", []) if name != b"content-length"]
+            response_headers += [(b"content-encoding", encoding.encode()), (b"content-length", str(len(body)).encode()), (b"vary", b"Accept-Encoding")]
+            await send({**start_message, "headers": response_headers})
+            await send({"type": "http.response.body", "body": body})
+
+        return wrapped_send
@@ -0,0 +1,34 @@
+import calendar
+import datetime
+import hashlib
+import json
+import struct
+from bson import ObjectId
+from pymongo import ASCENDING, IndexModel
+from roomsense2.serialization import naive_utc
+
+## idempotent log ingestion
+# a log is identified by (metadata.device, metadata.sensor, timestamp). its _id is derived from that key,
+# so a retried or repeated insert collides on _id (and the unique index) and is reported as already stored
+
+DUPLICATE_KEY_ERROR = 11000
+
+# unique dedupe key, not supported on time-series collections
+LOG_DEDUPE_INDEX = IndexModel(
+    [("metadata.device", ASCENDING), ("metadata.sensor", ASCENDING), ("timestamp", ASCENDING)],
+    name="device_sensor_timestamp_unique", unique=True
+)
+
+
+# mongodb keeps naive UTC datetimes at millisecond precision, the key uses the value as it will be stored
+def stored_timestamp(timestamp: datetime.datetime) -> datetime.datetime:
+    timestamp = naive_utc(timestamp)
+    return timestamp.replace(microsecond=timestamp.microsecond // 1000 * 1000)
+
+# 4 byte timestamp seconds like a generated ObjectId (keeps _id roughly time ordered) + 8 bytes of sha256 over the key
+def log_document_id(document: dict) -> ObjectId:
+    metadata = document["metadata"]
+    timestamp = stored_timestamp(document["timestamp"])
+    key = json.dumps([metadata["device"], metadata["sensor"], timestamp.isoformat()])
+    seconds = min(max(calendar.timegm(timestamp.utctimetuple()), 0), 0xFFFFFFFF)
+    return ObjectId(struct.pack(">I", seconds) + hashlib.sha256(key.encode()).digest()[:8])
@@ -12,4 +12,7 @@ class UpdateFailError(Exception):
     pass
 
 class UploadFailError(Exception):
-    pass
\ No newline at end of file
+    pass
+
+class InvalidQueryError(Exception):
+    pass
@@ -1,24 +1,49 @@
 from datetime import datetime
-import tomli
 from typing import Optional
-from pydantic import BaseModel
+from pydantic import BaseModel, Field
 from roomsense2.common_types import DeviceMeta, TimeseriesLog
+from roomsense2.serialization import api_version, FastJSONResponse
 
 ## classes for Multi Retrival Routes
 class DeviceMultiRetreivalRequest(BaseModel):
     device: Optional[str] = None
     sensor: Optional[list[str]] = None
     userSetLocation: Optional[str] = None
-    cursor: Optional[int] = None
-    limit: Optional[int]  = None
+    cursor: Optional[int] = Field(default=None, ge=0)
+    pageToken: Optional[str] = None
+    limit: Optional[int] = Field(default=None, ge=1)
+    count: bool = False
+    countLimit: int = Field(default=10000, ge=1)
 
 class TimeseriesMultiRetreivalRequest(BaseModel): 
     timestamp: Optional[datetime] = None
+    start: Optional[datetime] = None
+    end: Optional[datetime] = None
+    order: str = "desc" # desc | asc
     device: Optional[str] = None
     sensor: Optional[list[str]] = None
     dataFields: Optional[list[str]] = None
-    cursor: Optional[int] = None
-    limit: Optional[int] = None
+    cursor: Optional[int] = Field(default=None, ge=0)
+    pageToken: Optional[str] = None
+    limit: Optional[int] = Field(default=None, ge=1)
+    count: bool = False
+    countLimit: int = Field(default=10000, ge=1)
+    fields: Optional[list[str]] = None
+    irFormat: str = "list" # list | packed
+
+# numeric data fields and $dateTrunc units accepted by the aggregation route
+AGGREGATION_FIELDS = ["co2", "temperature", "humidity", "brightness"]
+AGGREGATION_UNITS = ["second", "minute", "hour", "day", "week", "month", "year"]
+
+class TimeseriesAggregationRequest(BaseModel):
+    field: str
+    device: Optional[str] = None
+    sensor: Optional[list[str]] = None
+    start: Optional[datetime] = None
+    end: Optional[datetime] = None
+    unit: str = "hour"
+    binSize: int = 1
+    source: str = "raw" # raw | rollup
 
 
 #usable for Device & Time Series Retrival Response
@@ -29,9 +54,7 @@ class RetreivalResponse:
 
 
     def __init__(self) -> None:
-        with open('pyproject.toml', 'rb') as toml_file:
-            pyproject_data = tomli.load(toml_file)
-            self.apiVersion = pyproject_data['tool']['poetry']['version']
+        self.apiVersion = api_version()
 
     def set_status(self, status:str):
         self.status = status
@@ -46,9 +69,16 @@ class RetreivalResponse:
             ret["result"] = self.result
         return ret
 
+    def to_response(self):
+        return FastJSONResponse(self.to_dict())
+
 ## classes for Upload Routes
 UploadDeviceRequest = DeviceMeta
 UploadLogRequest = TimeseriesLog
+UploadLogsRequest = list[TimeseriesLog]
+
+# upper bound on the number of logs accepted by a single bulk upload
+MAX_BULK_UPLOAD_LOGS = 1000
 
 class UploadResponse:
     apiVersion: str 
@@ -56,9 +86,7 @@ class UploadResponse:
     result: Optional[dict] = None
 
     def __init__(self):
-        with open('pyproject.toml', 'rb') as toml_file:
-            pyproject_data = tomli.load(toml_file)
-            self.apiVersion = pyproject_data['tool']['poetry']['version']
+        self.apiVersion = api_version()
 
     def set_status(self, status:str):
         self.status = status
@@ -73,7 +101,24 @@ class UploadResponse:
         if self.result is not None:
             ret["result"] = self.result
         return ret
+
+    def to_response(self):
+        return FastJSONResponse(self.to_dict())
     
+# presigned direct-to-bucket uploads, the device hashes the file itself
+MEDIA_BUCKET_KEYS = {"image": "Images", "audio": "Audios"}
+
+class PresignedUploadRequest(BaseModel):
+    kind: str = Field(pattern="^(image|audio)$")
+    sha256: str = Field(pattern="^[0-9a-f]{64}$")
+    extension: str = Field(pattern="^[A-Za-z0-9]{1,10}$")
+    contentType: Optional[str] = None
+
+class PresignedFinalizeRequest(BaseModel):
+    kind: str = Field(pattern="^(image|audio)$")
+    sha256: str = Field(pattern="^[0-9a-f]{64}$")
+    extension: str = Field(pattern="^[A-Za-z0-9]{1,10}$")
+
 ## result field objects
 class S3UploadResponse(UploadResponse):
     link: Optional[str] = None 
@@ -100,4 +145,29 @@ class MongodbUploadResponse(UploadResponse):
                 "insertedId": self.insertedId
             }
         return super().to_dict()
-    
+
+class MongodbBulkUploadResponse(UploadResponse):
+    insertedIds: Optional[list[str | None]] = None
+    failures: Optional[list[dict]] = None
+
+    def set_status(self, status:str):
+        self.status = status
+
+    def to_dict(self):
+        if self.insertedIds is not None:
+            self.result = {
+                "insertedIds": self.insertedIds,
+                "failures": self.failures if self.failures is not None else []
+            }
+        return super().to_dict()
+
+class S3PresignResponse(UploadResponse):
+    presigned: Optional[dict] = None
+
+    def set_status(self, status:str):
+        self.status = status
+
+    def to_dict(self):
+        if self.presigned is not None:
+            self.result = self.presigned
+        return super().to_dict()
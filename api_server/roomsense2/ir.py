@@ -0,0 +1,44 @@
+import math
+import sys
+from array import array
+
+## packed storage for MLX90640 IR frames
+# frames are stored as little-endian int16 centi-degrees (BSON Binary, 2 bytes per pixel)
+# instead of a list of BSON doubles (~13 bytes per pixel), covering -327.68..327.67 °C.
+# packing is lossy: values are rounded to the nearest centi-degree (halves away from zero)
+
+IR_FRAME_SCALE = 0.01
+IR_FORMATS = ["list", "packed"]
+
+INT16_MIN = -32768
+INT16_MAX = 32767
+
+
+# True when every value is finite and fits the packed range, frames failing this are rejected on ingest
+def frame_in_range(frame: list[float], scale: float = IR_FRAME_SCALE) -> bool:
+    return all(math.isfinite(value) and INT16_MIN <= round_half_away(value / scale) <= INT16_MAX for value in frame)
+
+# round() would round halves to even
+def round_half_away(value: float) -> int:
+    return int(math.copysign(math.floor(abs(value) + 0.5), value))
+
+# values outside the packed range are clamped to it
+def pack_frame(frame: list[float], scale: float = IR_FRAME_SCALE) -> bytes:
+    values = array("h", [max(INT16_MIN, min(INT16_MAX, round_half_away(value / scale))) for value in frame])
+    if sys.byteorder != "little":
+        values.byteswap()
+    return values.tobytes()
+
+def unpack_frame(packed: bytes, scale: float = IR_FRAME_SCALE) -> list[float]:
+    values = array("h")
+    values.frombytes(packed)
+    if sys.byteorder != "little":
+        values.byteswap()
+    return [round(value * scale, 2) for value in values]
+
+# replaces a packed frame in a stored log document by the expanded list of temperatures, in place
+def expand_ir_frame(doc: dict) -> dict:
+    data = doc.get("data")
+    if isinstance(data, dict) and "framePacked" in data:
+        data["frame"] = unpack_frame(bytes(data.pop("framePacked")), data.pop("frameScale", IR_FRAME_SCALE))
+    return doc
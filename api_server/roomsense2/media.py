@@ -0,0 +1,60 @@
+import datetime
+from typing import Optional
+from roomsense2.cache import TTLCache
+from roomsense2.mongodb import MongoDBInterface
+
+# content addressed index of uploaded media, one document per stored object:
+# { _id: "<bucket>/<sha256>.<ext>", bucket, key, link, refCount, createdAt, lastSeen }
+# refCount counts every upload that resolved to the object so unreferenced objects can be cleaned up later.
+# a small LRU in front of the collection answers repeated uploads without a lookup round trip
+class MediaIndex:
+
+    def __init__(self, db_interface:MongoDBInterface, cache_size:int = 4096, cache_ttl:float = 3600.0):
+        self.db_interface = db_interface
+        self.cache = TTLCache(cache_size, cache_ttl)
+
+    def collection(self):
+        return self.db_interface.collection("Media")
+
+    # link of an already stored object without counting a reference. None when the object is unknown
+    async def lookup(self, bucket_name:str, key:str) -> Optional[str]:
+        media_id = f"{bucket_name}/{key}"
+        link = self.cache.get(media_id)
+        if link is not None:
+            return link
+        doc = await self.collection().find_one({"_id": media_id}, {"link": 1})
+        if doc is None:
+            return None
+        self.cache.set(media_id, doc["link"])
+        return doc["link"]
+
+    # link of an already stored object, counting the new reference. None when the object is unknown
+    async def acquire(self, bucket_name:str, key:str) -> Optional[str]:
+        media_id = f"{bucket_name}/{key}"
+        update = {"$inc": {"refCount": 1}, "$set": {"lastSeen": datetime.datetime.utcnow()}}
+
+        link = self.cache.get(media_id)
+        if link is not None:
+            self.db_interface.run_in_background(self.collection().update_one({"_id": media_id}, update))
+            return link
+
+        doc = await self.collection().find_one_and_update({"_id": media_id}, update)
+        if doc is None:
+            return None
+        self.cache.set(media_id, doc["link"])
+        return doc["link"]
+
+    # record a freshly stored object with its first reference
+    async def register(self, bucket_name:str, key:str, link:str):
+        media_id = f"{bucket_name}/{key}"
+        now = datetime.datetime.utcnow()
+        await self.collection().update_one(
+            {"_id": media_id},
+            {
+                "$setOnInsert": {"bucket": bucket_name, "key": key, "link": link, "createdAt": now},
+                "$set": {"lastSeen": now},
+                "$inc": {"refCount": 1}
+            },
+            upsert=True
+        )
+        self.cache.set(media_id, link)
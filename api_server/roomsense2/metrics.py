@@ -0,0 +1,203 @@
+import os
+import threading
+import time
+from contextlib import contextmanager
+from typing import Callable
+
+## minimal prometheus instrumentation (text exposition format 0.0.4), rendered by GET /metrics
+# the registry lives in each worker process and only counts what that worker served. every sample carries
+# a worker="<pid>" label so scrapes landing on different workers add series instead of making counters jump:
+# scrape each worker, or scrape through the load balancer and aggregate with sum without (worker) (a worker's
+# series are only refreshed when a scrape reaches it). metrics are updated from the event loop and the S3 threadpool
+
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+SIZE_BUCKETS = (128, 512, 1024, 4096, 16384, 65536, 262144, 1048576, 4194304, 16777216)
+
+
+def format_labels(names:tuple[str, ...], values:tuple[str, ...], *extra:str) -> str:
+    pairs = [f'{name}="{escape_label(value)}"' for name, value in zip(names, values)]
+    pairs.extend(pair for pair in extra if pair)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+def escape_label(value:str) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+class Counter:
+    kind = "counter"
+
+    def __init__(self, name:str, documentation:str, label_names:tuple[str, ...] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.label_names = label_names
+        self.values: dict[tuple[str, ...], float] = dict()
+        self.lock = threading.Lock()
+
+    def inc(self, *labels:str, amount:float = 1):
+        with self.lock:
+            self.values[labels] = self.values.get(labels, 0) + amount
+
+    # constant is a preformatted label pair added to every sample (the worker label)
+    def samples(self, constant:str = ""):
+        with self.lock:
+            values = list(self.values.items())
+        for labels, value in values:
+            yield f"{self.name}{format_labels(self.label_names, labels, constant)} {value}"
+
+
+class Gauge(Counter):
+    kind = "gauge"
+
+    def dec(self, *labels:str, amount:float = 1):
+        self.inc(*labels, amount=-amount)
+
+    def set(self, *labels:str, value:float):
+        with self.lock:
+            self.values[labels] = value
+
+
+# counter or gauge read from a callback at scrape time, the callback returns {label values: value}
+class CallbackMetric(Counter):
+
+    def __init__(self, name:str, documentation:str, label_names:tuple[str, ...], callback:Callable[[], dict[tuple[str, ...], float]], kind:str = "gauge"):
+        super().__init__(name, documentation, label_names)
+        self.callback = callback
+        self.kind = kind
+
+    def samples(self, constant:str = ""):
+        values = self.callback()
+        with self.lock:
+            self.values = values
+        return super().samples(constant)
+
+
+class Histogram:
+    kind = "histogram"
+
+    def __init__(self, name:str, documentation:str, label_names:tuple[str, ...] = (), buckets:tuple[float, ...] = LATENCY_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.label_names = label_names
+        self.buckets = buckets
+        # label values -> (count per bucket, sum, count)
+        self.values: dict[tuple[str, ...], list] = dict()
+        self.lock = threading.Lock()
+
+    def observe(self, value:float, *labels:str):
+        with self.lock:
+            state = self.values.get(labels)
+            if state is None:
+                state = self.values[labels] = [[0] * len(self.buckets), 0.0, 0]
+            for index, bound in enumerate(self.buckets):
+                if value <= bound:
+                    state[0][index] += 1
+            state[1] += value
+            state[2] += 1
+
+    def samples(self, constant:str = ""):
+        # copied under the lock so every series is rendered consistently (buckets, sum and count of one moment)
+        with self.lock:
+            values = [(labels, list(bucket_counts), total, count) for labels, (bucket_counts, total, count) in self.values.items()]
+        for labels, bucket_counts, total, count in values:
+            for bound, bucket_count in zip(self.buckets, bucket_counts):
+                bucket_labels = format_labels(self.label_names, labels, constant, 'le="%s"' % bound)
+                yield f"{self.name}_bucket{bucket_labels} {bucket_count}"
+            bucket_labels = format_labels(self.label_names, labels, constant, 'le="+Inf"')
+            yield f"{self.name}_bucket{bucket_labels} {count}"
+            yield f"{self.name}_sum{format_labels(self.label_names, labels, constant)} {total}"
+            yield f"{self.name}_count{format_labels(self.label_names, labels, constant)} {count}"
+
+
+class MetricsRegistry:
+
+    def __init__(self):
+        self.metrics = list()
+
+    # a metric registered again under the same name replaces the earlier one (e.g. per app callbacks)
+    def register(self, metric):
+        self.metrics = [registered for registered in self.metrics if registered.name != metric.name]
+        self.metrics.append(metric)
+        return metric
+
+    # the worker label is read at render time, after a preloading master forked its workers
+    def render(self) -> str:
+        worker = f'worker="{os.getpid()}"'
+        lines = list()
+        for metric in self.metrics:
+            lines.append(f"# HELP {metric.name} {metric.documentation}")
+            lines.append(f"# TYPE {metric.name} {metric.kind}")
+            lines.extend(metric.samples(worker))
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = MetricsRegistry()
+
+REQUEST_LATENCY = REGISTRY.register(Histogram(
+    "roomsense2_http_request_duration_seconds", "HTTP request latency by route", ("method", "route", "status")))
+REQUESTS_IN_FLIGHT = REGISTRY.register(Gauge(
+    "roomsense2_http_requests_in_flight", "HTTP requests currently being served"))
+REQUEST_SIZE = REGISTRY.register(Histogram(
+    "roomsense2_http_request_size_bytes", "HTTP request body size by route", ("route",), SIZE_BUCKETS))
+RESPONSE_SIZE = REGISTRY.register(Histogram(
+    "roomsense2_http_response_size_bytes", "HTTP response body size by route", ("route",), SIZE_BUCKETS))
+BACKEND_LATENCY = REGISTRY.register(Histogram(
+    "roomsense2_backend_operation_duration_seconds", "MongoDB and S3 call latency", ("backend", "operation")))
+BACKEND_ERRORS = REGISTRY.register(Counter(
+    "roomsense2_backend_operation_errors_total", "MongoDB and S3 calls that raised", ("backend", "operation")))
+LOGS_INGESTED = REGISTRY.register(Counter(
+    "roomsense2_logs_ingested_total", "Log documents written by sensor type", ("sensor",)))
+
+
+# times the enclosed backend call, usable around awaits
+@contextmanager
+def timed(backend:str, operation:str):
+    start = time.perf_counter()
+    try:
+        yield
+    except BaseException:
+        BACKEND_ERRORS.inc(backend, operation)
+        raise
+    finally:
+        BACKEND_LATENCY.observe(time.perf_counter() - start, backend, operation)
+
+
+# ASGI middleware recording latency, in-flight count and payload sizes per route template
+class MetricsMiddleware:
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+
+        start = time.perf_counter()
+        status = 500
+        response_size = 0
+
+        async def send_wrapper(message):
+            nonlocal status, response_size
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            elif message["type"] == "http.response.body":
+                response_size += len(message.get("body", b""))
+            await send(message)
+
+        # read up front, inner middleware rewrites the headers of a decompressed request
+        request_size = None
+        for name, value in scope.get("headers", []):
+            if name == b"content-length":
+                request_size = int(value)
+                break
+
+        REQUESTS_IN_FLIGHT.inc()
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            REQUESTS_IN_FLIGHT.dec()
+            route = scope.get("route")
+            route_path = route.path if route is not None else "unmatched"
+            REQUEST_LATENCY.observe(time.perf_counter() - start, scope["method"], route_path, str(status))
+            if request_size is not None:
+                REQUEST_SIZE.observe(request_size, route_path)
+            RESPONSE_SIZE.observe(response_size, route_path)
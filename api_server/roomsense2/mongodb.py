@@ -1,24 +1,351 @@
+import asyncio
+import datetime
+import hashlib
 import motor.motor_asyncio
+import re
+import time
+from typing import Optional
 from roomsense2.common_types import TimeseriesLog, DeviceMeta
-from roomsense2.fmt import TimeseriesMultiRetreivalRequest, DeviceMultiRetreivalRequest
+from roomsense2.fmt import TimeseriesMultiRetreivalRequest, DeviceMultiRetreivalRequest, TimeseriesAggregationRequest, AGGREGATION_FIELDS, AGGREGATION_UNITS
+from roomsense2.errors import UpdateFailError, InvalidQueryError
+from roomsense2.pagination import *
+from roomsense2.serialization import bson_to_json, encode_json
+from roomsense2.rollups import *
+from roomsense2.cache import TTLCache
+from roomsense2.ir import IR_FORMATS, expand_ir_frame
+from roomsense2.snapshot import LatestReadings
+from roomsense2.pubsub import LogBroker
+from roomsense2.dedupe import DUPLICATE_KEY_ERROR, LOG_DEDUPE_INDEX, log_document_id
+from roomsense2.metrics import LOGS_INGESTED, timed
 from bson import ObjectId, json_util
+from pymongo import ASCENDING, DESCENDING, IndexModel
+from pymongo.errors import BulkWriteError, DuplicateKeyError, OperationFailure
+from pymongo.results import InsertOneResult
+
+# named collection option profiles (pymongo write_concern / read_preference), see MongoDBInterface.set_profile
+INGEST_PROFILE = "ingest"   # log writes, latency over durability
+DEVICE_PROFILE = "device"   # device registration, durable, and device reads right after it (primary)
+READ_PROFILE = "read"       # /v0 retrieval, may be served by secondaries
 
 class MongoDBInterface:
 
     collectionMapping : dict[str,str] = dict()
+    logBuffer: Optional["LogWriteBuffer"] = None
+    rollupsEnabled: bool = False
+    rollupBuffer: Optional["RollupWriteBuffer"] = None
+    deviceCache: Optional[TTLCache] = None
+    # bumped by every invalidation, a read only caches its result when no invalidation happened while it ran
+    deviceCacheGeneration: int = 0
+    deviceCacheInvalidatedAt: Optional[float] = None
+    deviceCachePrimaryWindow: float = 0
+    changeStreamEnabled: bool = False
+    changeStreamTask: Optional[asyncio.Task] = None
+    deviceChangeStreamTask: Optional[asyncio.Task] = None
+    latestReadingsTask: Optional[asyncio.Task] = None
 
-    def __init__(self, connectionString:str, databaseName:str):
-        self.client = motor.motor_asyncio.AsyncIOMotorClient(connectionString)
+    # client_options go to the motor client (maxPoolSize, minPoolSize, connectTimeoutMS, ...),
+    # an existing client can be passed instead, e.g. a stand-in for benchmarks
+    def __init__(self, connectionString:str, databaseName:str, client = None, **client_options):
+        self.client = client if client is not None else motor.motor_asyncio.AsyncIOMotorClient(connectionString, **client_options)
         self.database = self.client[databaseName] 
+        self.collectionMapping = dict()
+        self.profiles: dict[str, dict] = dict()
+        self.collections: dict[tuple[str, Optional[str]], object] = dict()
+        self.backgroundTasks: set[asyncio.Task] = set()
+        self.latestReadings = LatestReadings()
+        self.latestReadingsLock = asyncio.Lock()
+        # seconds between reloads of the latest readings from mongodb (by the task start_latest_readings_refresh starts),
+        # 0 keeps them for the process lifetime. set it when several workers ingest, each worker only sees its own inserts in between
+        self.latestReadingsRefresh: float = 0
+        self.logBroker = LogBroker()
+        self.countCache = TTLCache(1024, 10.0)
     
     def set_collection_mapping(self, key:str, value:str):
         self.collectionMapping[key] = value
+        self.collections.clear()
+
+    # options passed to get_collection for every operation run under the profile, e.g.
+    # set_profile(INGEST_PROFILE, write_concern=WriteConcern(w=1, j=False))
+    def set_profile(self, name:str, **options):
+        self.profiles[name] = options
+        self.collections.clear()
+
+    # collection of a mapping key with the options of a profile, a profile that was never set uses the client defaults
+    def collection(self, key:str, profile:Optional[str] = None):
+        cache_key = (key, profile)
+        coll = self.collections.get(cache_key)
+        if coll is None:
+            coll = self.database.get_collection(self.collectionMapping[key], **self.profiles.get(profile, dict()))
+            self.collections[cache_key] = coll
+        return coll
+
+    # route insert_log calls through a write-behind buffer that is flushed as one bulk write
+    def enable_log_buffer(self, max_size:int = 500, max_delay:float = 0.05):
+        self.logBuffer = LogWriteBuffer(self, max_size, max_delay)
+
+    # cache read_device_info and read_paginated_device results, cleared whenever insert_device writes.
+    # for primary_window seconds after that the cache is repopulated from the primary (DEVICE_PROFILE),
+    # a secondary that has not replicated the write yet would put the old device back for a whole ttl.
+    # the cache is per process, other workers only see a write once their entries expire after ttl seconds
+    # unless the change stream is enabled, which then clears the cache on every Devices change
+    def enable_device_cache(self, max_size:int = 1024, ttl:float = 30.0, primary_window:float = 10.0):
+        self.deviceCache = TTLCache(max_size, ttl)
+        self.deviceCachePrimaryWindow = primary_window
+
+    def invalidate_device_cache(self):
+        if self.deviceCache is None:
+            return
+        self.deviceCache.clear()
+        self.deviceCacheGeneration += 1
+        self.deviceCacheInvalidatedAt = time.monotonic()
+
+    # profile of a device read, see enable_device_cache
+    def device_read_profile(self):
+        if self.deviceCacheInvalidatedAt is not None and time.monotonic() - self.deviceCacheInvalidatedAt < self.deviceCachePrimaryWindow:
+            return DEVICE_PROFILE
+        return READ_PROFILE
+
+    # maintain the rollup collections (see roomsense2.rollups) from every successful log insert, through a
+    # write-behind buffer of at most max_buckets buckets flushed every max_delay seconds.
+    # requires collection mappings for the RollupsMinute, RollupsHour and RollupsDay keys
+    def enable_rollups(self, max_buckets:int = 1000, max_delay:float = 1.0):
+        self.rollupsEnabled = True
+        self.rollupBuffer = RollupWriteBuffer(self, max_buckets, max_delay)
+
+    # feed live subscribers and the latest readings from a mongodb change stream on Logs instead of
+    # this process's own inserts, so every worker sees every insert (needs a replica set, not time-series Logs).
+    # with the device cache enabled a second change stream on Devices invalidates it for writes of every worker
+    def enable_change_stream(self):
+        self.changeStreamEnabled = True
+
+    def start_change_stream(self):
+        if self.changeStreamEnabled and self.changeStreamTask is None:
+            self.changeStreamTask = asyncio.get_running_loop().create_task(watch_log_changes(self))
+        if self.changeStreamEnabled and self.deviceCache is not None and self.deviceChangeStreamTask is None:
+            self.deviceChangeStreamTask = asyncio.get_running_loop().create_task(watch_device_changes(self))
+
+    # periodic reload of the latest readings off the request path, requests keep reading the current table meanwhile
+    def start_latest_readings_refresh(self):
+        if self.latestReadingsRefresh > 0 and self.latestReadingsTask is None:
+            self.latestReadingsTask = asyncio.get_running_loop().create_task(refresh_latest_readings_periodically(self))
+
+    # work that must not hold up the request it was started from, awaited on close
+    def run_in_background(self, coroutine):
+        task = asyncio.get_running_loop().create_task(coroutine)
+        self.backgroundTasks.add(task)
+        task.add_done_callback(self.backgroundTasks.discard)
+
+    async def close(self):
+        for task in (self.changeStreamTask, self.deviceChangeStreamTask, self.latestReadingsTask):
+            if task is not None:
+                task.cancel()
+                await asyncio.gather(task, return_exceptions=True)
+        self.changeStreamTask = None
+        self.deviceChangeStreamTask = None
+        self.latestReadingsTask = None
+        if self.logBuffer is not None:
+            await self.logBuffer.flush()
+        if self.rollupBuffer is not None:
+            await self.rollupBuffer.flush()
+        if len(self.backgroundTasks) > 0:
+            await asyncio.gather(*self.backgroundTasks, return_exceptions=True)
+        self.client.close()
+
+
+# collects log documents from concurrent requests and writes them with a single insert_many
+# once max_size documents are pending or the oldest one has waited max_delay seconds.
+# every submitter awaits the outcome of its own document.
+class LogWriteBuffer:
+
+    def __init__(self, db_interface:MongoDBInterface, max_size:int = 500, max_delay:float = 0.05):
+        self.db_interface = db_interface
+        self.max_size = max_size
+        self.max_delay = max_delay
+        self.pending: list[tuple[dict, asyncio.Future]] = list()
+        self.timer: Optional[asyncio.TimerHandle] = None
+        self.flushes: set[asyncio.Task] = set()
+
+    async def submit(self, document:dict):
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        self.pending.append((document, future))
+        if len(self.pending) >= self.max_size:
+            self._schedule_flush()
+        elif self.timer is None:
+            self.timer = loop.call_later(self.max_delay, self._schedule_flush)
+        return await future
+
+    def _schedule_flush(self):
+        if self.timer is not None:
+            self.timer.cancel()
+            self.timer = None
+        if len(self.pending) == 0:
+            return
+        batch, self.pending = self.pending, list()
+        task = asyncio.get_running_loop().create_task(self._write(batch))
+        self.flushes.add(task)
+        task.add_done_callback(self.flushes.discard)
+
+    async def flush(self):
+        self._schedule_flush()
+        if len(self.flushes) > 0:
+            await asyncio.gather(*self.flushes, return_exceptions=True)
+
+    async def _write(self, batch:list[tuple[dict, asyncio.Future]]):
+        coll = self.db_interface.collection("Logs", INGEST_PROFILE)
+        documents = [document for document, _ in batch]
+        try:
+            failed, duplicates = await insert_documents(coll, documents)
+        except Exception as e:
+            print(f"buffered insert of {len(batch)} logs failed: {e}")
+            for _, future in batch:
+                if not future.done():
+                    future.set_exception(e)
+            return
+
+        for index, (document, future) in enumerate(batch):
+            if future.done():
+                continue
+            if index in failed:
+                print(f"buffered insert failed for log document: {failed[index]}")
+                future.set_exception(UpdateFailError())
+            else:
+                future.set_result(document["_id"])
+        await after_logs_inserted(self.db_interface, [document for index, document in enumerate(documents) if index not in failed and index not in duplicates])
+
+
+# merges the rollup buckets of inserted logs across requests and upserts them in one bulk write per
+# rollup collection once max_buckets buckets are pending or the oldest has waited max_delay seconds.
+# one write is in flight at a time, while it runs new logs keep merging into the pending buckets;
+# a full buffer makes ingest wait for the write in flight instead of growing while mongodb is slow
+class RollupWriteBuffer:
+
+    def __init__(self, db_interface:MongoDBInterface, max_buckets:int = 1000, max_delay:float = 1.0):
+        self.db_interface = db_interface
+        self.max_buckets = max_buckets
+        self.max_delay = max_delay
+        # rollup unit -> buckets, see roomsense2.rollups.add_rollup_buckets
+        self.pending: dict[str, dict[tuple, dict]] = {unit: dict() for _, unit in ROLLUP_RESOLUTIONS}
+        self.timer: Optional[asyncio.TimerHandle] = None
+        self.writing: Optional[asyncio.Task] = None
+
+    def size(self):
+        return sum(len(buckets) for buckets in self.pending.values())
+
+    async def add(self, documents:list[dict]):
+        for _, unit in ROLLUP_RESOLUTIONS:
+            add_rollup_buckets(self.pending[unit], documents, unit)
+        if self.size() >= self.max_buckets:
+            self._schedule_flush()
+            while self.writing is not None and self.size() >= self.max_buckets:
+                await asyncio.shield(self.writing)
+        elif self.timer is None and self.writing is None and self.size() > 0:
+            self.timer = asyncio.get_running_loop().call_later(self.max_delay, self._schedule_flush)
+
+    def _schedule_flush(self):
+        if self.timer is not None:
+            self.timer.cancel()
+            self.timer = None
+        # the write in flight schedules the next one when it is done
+        if self.writing is not None or self.size() == 0:
+            return
+        batch = self.pending
+        self.pending = {unit: dict() for _, unit in ROLLUP_RESOLUTIONS}
+        self.writing = asyncio.get_running_loop().create_task(self._write(batch))
+        self.writing.add_done_callback(self._written)
+
+    def _written(self, _):
+        self.writing = None
+        if self.size() >= self.max_buckets:
+            self._schedule_flush()
+        elif self.size() > 0 and self.timer is None:
+            self.timer = asyncio.get_running_loop().call_later(self.max_delay, self._schedule_flush)
+
+    async def flush(self):
+        while self.writing is not None or self.size() > 0:
+            self._schedule_flush()
+            if self.writing is not None:
+                await asyncio.gather(self.writing, return_exceptions=True)
+
+    # failures are logged and never reach the ingest requests
+    async def _write(self, batch:dict[str, dict[tuple, dict]]):
+        async def write(rollup_key:str, unit:str):
+            updates = bucket_updates(batch[unit])
+            if len(updates) == 0:
+                return
+            coll = self.db_interface.collection(rollup_key, INGEST_PROFILE)
+            try:
+                with timed("mongodb", "bulk_write"):
+                    await coll.bulk_write(updates, ordered=False)
+            except Exception as e:
+                print(f"failed to update {rollup_key} rollups: {e}")
+
+        await asyncio.gather(*[write(rollup_key, unit) for rollup_key, unit in ROLLUP_RESOLUTIONS])
 
 ## helper methods that uses mongodb interface for local application
 
+# indexes backing the filters built by the readers and the upsert in insert_device
+LOG_INDEXES = [
+    IndexModel([("metadata.device", ASCENDING), ("metadata.sensor", ASCENDING), ("timestamp", DESCENDING), ("_id", DESCENDING)], name="device_sensor_timestamp"),
+    IndexModel([("metadata.sensor", ASCENDING), ("timestamp", DESCENDING), ("_id", DESCENDING)], name="sensor_timestamp"),
+    IndexModel([("timestamp", DESCENDING), ("_id", DESCENDING)], name="timestamp"),
+]
+DEVICE_INDEXES = [
+    IndexModel([("userSetLocation", ASCENDING)], name="user_set_location"),
+    IndexModel([("sensors", ASCENDING)], name="sensors"),
+]
+DEVICE_UNIQUE_INDEX = IndexModel([("device", ASCENDING)], name="device_unique", unique=True)
+
+# run once at startup, creating indexes is a no-op when they already exist
+# with logs_timeseries the Logs collection is created as a native time-series collection (bucketed by metadata)
+# this only applies when the collection does not exist yet, an existing collection can not be converted in place
+async def ensure_indexes(db_interface:MongoDBInterface, logs_timeseries:bool = False):
+    logs_name = db_interface.collectionMapping["Logs"]
+    devices_name = db_interface.collectionMapping["Devices"]
+
+    if logs_timeseries:
+        existing = await db_interface.database.list_collection_names(filter={"name": logs_name})
+        if len(existing) == 0:
+            print(f"creating time-series collection {logs_name}")
+            await db_interface.database.create_collection(
+                logs_name,
+                timeseries={"timeField": "timestamp", "metaField": "metadata", "granularity": "seconds"}
+            )
+
+    collection_indexes = [(logs_name, LOG_INDEXES), (devices_name, DEVICE_INDEXES)]
+    if db_interface.rollupsEnabled:
+        collection_indexes += [(db_interface.collectionMapping[key], ROLLUP_INDEXES) for key, _ in ROLLUP_RESOLUTIONS]
+
+    for name, indexes in collection_indexes:
+        try:
+            created = await db_interface.database[name].create_indexes(indexes)
+            print(f"ensured indexes on {name}: {created}")
+        except OperationFailure as e:
+            print(f"failed to create indexes on {name}: {e}")
+
+    # the unique indexes are created on their own so existing duplicates (which make them fail) do not hold up the other indexes
+    try:
+        created = await db_interface.database[devices_name].create_indexes([DEVICE_UNIQUE_INDEX])
+        print(f"ensured indexes on {devices_name}: {created}")
+    except OperationFailure as e:
+        print(f"failed to create device unique index on {devices_name}, remove duplicate devices first: {e}")
+
+    # time-series collections support neither unique indexes nor a unique _id, their logs are not deduplicated
+    if not logs_timeseries:
+        try:
+            created = await db_interface.database[logs_name].create_indexes([LOG_DEDUPE_INDEX])
+            print(f"ensured indexes on {logs_name}: {created}")
+        except OperationFailure as e:
+            print(f"failed to create log dedupe index on {logs_name}, remove duplicate logs first: {e}")
+
 
 async def read_paginated_device(db_interface:MongoDBInterface, query: DeviceMultiRetreivalRequest):
-    
+    cache_key = ("page", query.model_dump_json())
+    if db_interface.deviceCache is not None:
+        cached = db_interface.deviceCache.get(cache_key)
+        if cached is not None:
+            return cached
+
     def query_to_filter(query: DeviceMultiRetreivalRequest):
         filter = dict()
         if query.device is not None:
@@ -31,11 +358,17 @@ async def read_paginated_device(db_interface:MongoDBInterface, query: DeviceMult
         print(f"searching mongodb devices collection with filter: {filter}")
         return  filter
 
-    coll = db_interface.database[db_interface.collectionMapping["Devices"]]
-    filter = query_to_filter(query)
+    generation = db_interface.deviceCacheGeneration
+    coll = db_interface.collection("Devices", db_interface.device_read_profile())
+    base_filter = query_to_filter(query)
+    seek_filter = None
+    filter = base_filter
+    if query.pageToken is not None:
+        seek_filter = device_seek_filter(parse_device_page_token(query.pageToken))
+        filter = {"$and": [base_filter, seek_filter]}
 
-    mongo_cursor = coll.find(filter)
-    if query.cursor is not None:
+    mongo_cursor = coll.find(filter).sort(DEVICE_PAGE_SORT)
+    if query.cursor is not None and query.pageToken is None:
         mongo_cursor = mongo_cursor.skip(query.cursor)
     if query.limit is not None:
         if query.limit > 100:
@@ -45,100 +378,506 @@ async def read_paginated_device(db_interface:MongoDBInterface, query: DeviceMult
         mongo_cursor = mongo_cursor.limit(50)
 
     page = list()
-    async for doc in mongo_cursor:
-        python_dict = json_util.loads(json_util.dumps(doc))
-        python_dict["_id"] = str(python_dict["_id"])
-        page.append(python_dict)
+    last_id = None
+    with timed("mongodb", "find_devices"):
+        async for doc in mongo_cursor:
+            last_id = doc["_id"]
+            page.append(bson_to_json(doc))
 
     ret=dict()
     ret["data"] = page
     page_size = len(page)
-    match (query.cursor, query.limit):
-        case (None, None):
-            ret["cursor"] = None if page_size < 50 else page_size
-        case (None, limit):
-            ret["cursor"] = None if page_size < limit else page_size
-        case (cursor, None):
-            ret["cursor"] = None if page_size < 50 else cursor + page_size
-        case (cursor, limit):
-            ret["cursor"] = None if page_size < limit else cursor + limit
+    page_limit = 50 if query.limit is None else query.limit
+    ret["nextPageToken"] = None if page_size < page_limit or last_id is None else device_page_token(last_id)
+    if query.pageToken is not None:
+        ret["cursor"] = None
+    else:
+        match (query.cursor, query.limit):
+            case (None, None):
+                ret["cursor"] = None if page_size < 50 else page_size
+            case (None, limit):
+                ret["cursor"] = None if page_size < limit else page_size
+            case (cursor, None):
+                ret["cursor"] = None if page_size < 50 else cursor + page_size
+            case (cursor, limit):
+                ret["cursor"] = None if page_size < limit else cursor + limit
+
+    if query.count:
+        ret["count"] = await page_counts(db_interface, "Devices", base_filter, seek_filter, query.cursor or 0, page_size, query.countLimit)
 
+    if db_interface.deviceCache is not None and generation == db_interface.deviceCacheGeneration:
+        db_interface.deviceCache.set(cache_key, ret)
     return ret
 
+# filter shared by the log readers (paginated and export)
+# start is inclusive, end exclusive, the legacy timestamp field is an inclusive upper bound
+def logs_query_to_filter(query: TimeseriesMultiRetreivalRequest):
+    if query.irFormat not in IR_FORMATS:
+        raise InvalidQueryError(f"irFormat must be one of {IR_FORMATS}")
+    if query.order not in LOG_PAGE_ORDERS:
+        raise InvalidQueryError(f"order must be one of {LOG_PAGE_ORDERS}")
+    filter = dict()
+    if query.device is not None:
+        filter["metadata.device"] = query.device
+    if query.timestamp is not None or query.start is not None or query.end is not None:
+        filter["timestamp"] = dict()
+        if query.start is not None:
+            filter["timestamp"]["$gte"] = query.start
+        if query.end is not None:
+            filter["timestamp"]["$lt"] = query.end
+        if query.timestamp is not None:
+            filter["timestamp"]["$lte"] = query.timestamp
+    if query.sensor is not None:
+        filter["metadata.sensor"] = {"$in": query.sensor}
+    if query.dataFields is not None: 
+        for field in query.dataFields:
+            filter[f"data.{field}"] = {"$exists": True }
+    print(f"searching mongodb logs collection with filter: {filter}")
+    return  filter
+
+# documents after the page token, None without one
+def logs_query_to_seek_filter(query: TimeseriesMultiRetreivalRequest):
+    if query.pageToken is None:
+        return None
+    return log_seek_filter(*parse_log_page_token(query.pageToken, query.order))
+
+# matches of a filter counted up to count_limit, cached briefly per filter.
+# an empty filter uses the collection metadata (estimated_document_count) instead of counting
+async def count_capped(db_interface:MongoDBInterface, collection_key:str, filter:dict, count_limit:int):
+    cache_key = (collection_key, hashlib.sha1(json_util.dumps(filter, sort_keys=True).encode()).hexdigest(), count_limit)
+    cached = db_interface.countCache.get(cache_key)
+    if cached is not None:
+        return cached
+
+    coll = db_interface.collection(collection_key, READ_PROFILE)
+    if len(filter) == 0:
+        with timed("mongodb", "estimated_document_count"):
+            count = await coll.estimated_document_count()
+        result = (count, False)
+    else:
+        with timed("mongodb", "count_documents"):
+            # one past the limit tells exactly count_limit matches apart from more
+            count = await coll.count_documents(filter, limit=count_limit + 1)
+        result = (min(count, count_limit), count > count_limit)
+    db_interface.countCache.set(cache_key, result)
+    return result
+
+# total matches of the query and matches left after the current page. with capped set the numbers are lower bounds
+async def page_counts(db_interface:MongoDBInterface, collection_key:str, base_filter:dict, seek_filter:Optional[dict], offset:int, page_size:int, count_limit:int):
+    total, capped = await count_capped(db_interface, collection_key, base_filter, count_limit)
+    if seek_filter is None:
+        remaining = max(total - offset - page_size, 0)
+    else:
+        after_token, after_token_capped = await count_capped(db_interface, collection_key, {"$and": [base_filter, seek_filter]}, count_limit)
+        remaining = max(after_token - page_size, 0)
+        capped = capped or after_token_capped
+    return {"total": total, "remaining": remaining, "capped": capped}
+
+# projection for the requested fields, None returns whole documents
+# timestamp and _id are always kept since page tokens are built from them, a projection limited to
+# metadata.device, metadata.sensor and timestamp is covered by the device_sensor_timestamp index
+def logs_query_to_projection(query: TimeseriesMultiRetreivalRequest):
+    if query.fields is None:
+        return None
+    paths = {"timestamp"}
+    for field in query.fields:
+        if re.fullmatch(r"[A-Za-z][A-Za-z0-9_]*(\.[A-Za-z][A-Za-z0-9_]*)*", field) is None:
+            raise InvalidQueryError(f"invalid field name: {field}")
+        if field == "data.frame":
+            # stored packed, older documents still hold the plain list
+            paths.update(["data.frame", "data.framePacked", "data.frameScale"])
+        else:
+            paths.add(field)
+    # mongodb rejects a projection holding both a path and one of its parents
+    return {
+        path: 1 for path in paths
+        if not any(path.startswith(f"{other}.") for other in paths)
+    }
+
 # reading paginated Log data by filter and cursor
 async def read_paginated_logs(db_interface:MongoDBInterface, query: TimeseriesMultiRetreivalRequest):
-    def query_to_filter(query: TimeseriesMultiRetreivalRequest):
-        filter = dict()
-        if query.device is not None:
-            filter["metadata.device"] = query.device
-        if query.datetime is not None:
-            filter["timestamp"] = {"$lte": query.datetime}
-        if query.sensor is not None:
-            filter["metadata.sensor"] = {"$in": query.sensor}
-        if query.dataFields is not None: 
-            for field in query.dataFields:
-                filter[f"data.{field}"] = {"$exists": True }
-        print(f"searching mongodb devices collection with filter: {filter}")
-        return  filter
-
-    coll = db_interface.database[db_interface.collectionMapping["Logs"]]
-    filter = query_to_filter(query)
+    coll = db_interface.collection("Logs", READ_PROFILE)
+    base_filter = logs_query_to_filter(query)
+    seek_filter = logs_query_to_seek_filter(query)
+    filter = base_filter if seek_filter is None else {"$and": [base_filter, seek_filter]}
+    projection = logs_query_to_projection(query)
 
-    mongo_cursor = coll.find(filter)
-    if query.cursor is not None:
+    mongo_cursor = coll.find(filter, projection).sort(log_page_sort(query.order))
+    if query.cursor is not None and query.pageToken is None:
         mongo_cursor = mongo_cursor.skip(query.cursor)
     if query.limit is not None:
-        mongo_cursor = mongo_cursor.limit(query.limit)
-    else:
         if query.limit > 500:
             query.limit = 500 
+        mongo_cursor = mongo_cursor.limit(query.limit)
+    else:
         mongo_cursor = mongo_cursor.limit(50)
 
     page = list()
-    async for doc in mongo_cursor:
-        python_dict = json_util.loads(json_util.dumps(doc))
-        python_dict["_id"] = str(python_dict["_id"])
-        python_dict["timestamp"] = str(python_dict["timestamp"])
-        page.append(python_dict)
+    last_doc = None
+    with timed("mongodb", "find_logs"):
+        async for doc in mongo_cursor:
+            last_doc = doc
+            if query.irFormat == "list":
+                expand_ir_frame(doc)
+            page.append(bson_to_json(doc))
 
     ret=dict()
     ret["data"] = page
     page_size = len(page)
-    match (query.cursor, query.limit):
-        case (None, None):
-            ret["cursor"] = None if page_size < 50 else page_size
-        case (None, limit):
-            ret["cursor"] = None if page_size < limit else page_size
-        case (cursor, None):
-            ret["cursor"] = None if page_size < 50 else cursor + page_size
-        case (cursor, limit):
-            ret["cursor"] = None if page_size < limit else cursor + limit
+    page_limit = 50 if query.limit is None else query.limit
+    ret["nextPageToken"] = None if page_size < page_limit or last_doc is None else log_page_token(last_doc["timestamp"], last_doc["_id"], query.order)
+    if query.pageToken is not None:
+        ret["cursor"] = None
+    else:
+        match (query.cursor, query.limit):
+            case (None, None):
+                ret["cursor"] = None if page_size < 50 else page_size
+            case (None, limit):
+                ret["cursor"] = None if page_size < limit else page_size
+            case (cursor, None):
+                ret["cursor"] = None if page_size < 50 else cursor + page_size
+            case (cursor, limit):
+                ret["cursor"] = None if page_size < limit else cursor + limit
 
+    if query.count:
+        ret["count"] = await page_counts(db_interface, "Logs", base_filter, seek_filter, query.cursor or 0, page_size, query.countLimit)
     return ret
 
+# streaming every Log matching the filter as newline-delimited JSON
+# the filter is built eagerly so an invalid query raises before the response starts,
+# documents are then pulled batch_size at a time and never held in memory together
+def stream_logs(db_interface:MongoDBInterface, query: TimeseriesMultiRetreivalRequest, batch_size:int = 1000):
+    coll = db_interface.collection("Logs", READ_PROFILE)
+    filter = logs_query_to_filter(query)
+    seek_filter = logs_query_to_seek_filter(query)
+    if seek_filter is not None:
+        filter = {"$and": [filter, seek_filter]}
+    projection = logs_query_to_projection(query)
+
+    mongo_cursor = coll.find(filter, projection).sort(log_page_sort(query.order)).batch_size(batch_size)
+    if query.limit is not None:
+        mongo_cursor = mongo_cursor.limit(query.limit)
+
+    async def generate():
+        try:
+            async for doc in mongo_cursor:
+                if query.irFormat == "list":
+                    expand_ir_frame(doc)
+                yield encode_json(bson_to_json(doc)) + b"\n"
+        finally:
+            await mongo_cursor.close()
+
+    return generate()
+
+# min/max/mean/count of one numeric data field per time bucket, computed by mongodb
+# buckets are aligned with $dateTrunc (MongoDB 5.0+), start is inclusive and end exclusive
+# with source "rollup" the coarsest rollup collection that fits the bucket unit is regrouped instead of the raw logs,
+# range bounds are then applied to rollup bucket starts and units finer than a minute fall back to raw logs
+async def aggregate_logs(db_interface:MongoDBInterface, query: TimeseriesAggregationRequest):
+    if query.field not in AGGREGATION_FIELDS:
+        raise InvalidQueryError(f"field must be one of {AGGREGATION_FIELDS}")
+    if query.unit not in AGGREGATION_UNITS:
+        raise InvalidQueryError(f"unit must be one of {AGGREGATION_UNITS}")
+    if query.binSize < 1:
+        raise InvalidQueryError("binSize must be at least 1")
+    if query.source not in ("raw", "rollup"):
+        raise InvalidQueryError("source must be raw or rollup")
+
+    if query.source == "rollup" and db_interface.rollupsEnabled:
+        rollup = select_rollup(query.unit)
+        if rollup is not None:
+            return await aggregate_rollups(db_interface, query, *rollup)
+
+    match = {f"data.{query.field}": {"$type": "number"}}
+    if query.device is not None:
+        match["metadata.device"] = query.device
+    if query.sensor is not None:
+        match["metadata.sensor"] = {"$in": query.sensor}
+    if query.start is not None or query.end is not None:
+        match["timestamp"] = dict()
+        if query.start is not None:
+            match["timestamp"]["$gte"] = query.start
+        if query.end is not None:
+            match["timestamp"]["$lt"] = query.end
+
+    value = f"$data.{query.field}"
+    pipeline = [
+        {"$match": match},
+        {"$group": {
+            "_id": {"$dateTrunc": {"date": "$timestamp", "unit": query.unit, "binSize": query.binSize}},
+            "min": {"$min": value},
+            "max": {"$max": value},
+            "mean": {"$avg": value},
+            "count": {"$sum": 1}
+        }},
+        {"$sort": {"_id": 1}}
+    ]
+    print(f"aggregating mongodb logs collection with pipeline: {pipeline}")
+
+    coll = db_interface.collection("Logs", READ_PROFILE)
+    buckets = list()
+    with timed("mongodb", "aggregate"):
+        async for doc in coll.aggregate(pipeline):
+            bucket = bson_to_json(doc)
+            bucket["start"] = bucket.pop("_id")
+            buckets.append(bucket)
+
+    return {
+        "field": query.field,
+        "unit": query.unit,
+        "binSize": query.binSize,
+        "source": "raw",
+        "buckets": buckets
+    }
+
+async def aggregate_rollups(db_interface:MongoDBInterface, query: TimeseriesAggregationRequest, rollup_key:str, rollup_unit:str):
+    match = dict()
+    if query.device is not None:
+        match["device"] = query.device
+    if query.sensor is not None:
+        match["sensor"] = {"$in": query.sensor}
+    if query.start is not None or query.end is not None:
+        match["start"] = dict()
+        if query.start is not None:
+            match["start"]["$gte"] = bucket_start(query.start, rollup_unit)
+        if query.end is not None:
+            match["start"]["$lt"] = query.end
+
+    pipeline = rollup_pipeline(match, query.field, query.unit, query.binSize)
+    print(f"aggregating mongodb {rollup_key} collection with pipeline: {pipeline}")
+
+    coll = db_interface.collection(rollup_key, READ_PROFILE)
+    buckets = list()
+    with timed("mongodb", "aggregate"):
+        async for doc in coll.aggregate(pipeline):
+            bucket = bson_to_json(doc)
+            bucket["start"] = bucket.pop("_id")
+            buckets.append(bucket)
+
+    return {
+        "field": query.field,
+        "unit": query.unit,
+        "binSize": query.binSize,
+        "source": rollup_key,
+        "buckets": buckets
+    }
+
+# latest log per (device, sensor) served from memory, loaded from mongodb on cold start and then
+# only reloaded by the refresh task, never within a request
+async def read_latest_logs(db_interface:MongoDBInterface, device:Optional[str] = None, sensors:Optional[list[str]] = None, ir_format:str = "list"):
+    if ir_format not in IR_FORMATS:
+        raise InvalidQueryError(f"irFormat must be one of {IR_FORMATS}")
+
+    readings = db_interface.latestReadings
+    if not readings.is_warm():
+        async with db_interface.latestReadingsLock:
+            if not readings.is_warm():
+                await load_latest_readings(db_interface)
+
+    return [log_document_to_json(doc, ir_format) for doc in readings.snapshot(device, sensors)]
+
+# reloads only read logs stamped at most this long before the newest log of the previous load,
+# logs of other workers and devices that arrive later than that are only picked up by a restart
+LATEST_READINGS_SKEW = datetime.timedelta(minutes=5)
+
+# (re)loads the latest readings with a $sort + $group that walks the device_sensor_timestamp index.
+# the first load reads every log, reloads only the logs since the previous load (less LATEST_READINGS_SKEW)
+# and merge them into the table. it is updated in one step once the aggregation finished, so readers never see a partial load
+async def load_latest_readings(db_interface:MongoDBInterface):
+    readings = db_interface.latestReadings
+    pipeline = [
+        {"$sort": {"metadata.device": 1, "metadata.sensor": 1, "timestamp": -1}},
+        {"$group": {"_id": {"device": "$metadata.device", "sensor": "$metadata.sensor"}, "doc": {"$first": "$$ROOT"}}},
+        {"$replaceRoot": {"newRoot": "$doc"}}
+    ]
+    if readings.loadedUntil is not None:
+        pipeline.insert(0, {"$match": {"timestamp": {"$gte": readings.loadedUntil - LATEST_READINGS_SKEW}}})
+    print("loading latest readings from mongodb logs collection")
+    coll = db_interface.collection("Logs", READ_PROFILE)
+    with timed("mongodb", "aggregate"):
+        documents = [doc async for doc in coll.aggregate(pipeline)]
+    readings.update(documents)
+    if len(documents) > 0:
+        newest = max(doc["timestamp"] for doc in documents)
+        readings.loadedUntil = newest if readings.loadedUntil is None else max(readings.loadedUntil, newest)
+    readings.mark_warm()
+
+# runs for the lifetime of the app, a failed reload keeps the current table until the next interval
+async def refresh_latest_readings_periodically(db_interface:MongoDBInterface):
+    while True:
+        try:
+            async with db_interface.latestReadingsLock:
+                await load_latest_readings(db_interface)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            print(f"latest readings refresh failed, keeping the current table: {e}")
+        await asyncio.sleep(db_interface.latestReadingsRefresh)
+
+# JSON-ready copy of a shared log document (snapshot table, live subscriptions), never modifying the original
+def log_document_to_json(doc:dict, ir_format:str = "list"):
+    doc = {**doc, "data": dict(doc["data"])} if isinstance(doc.get("data"), dict) else dict(doc)
+    if ir_format == "list":
+        expand_ir_frame(doc)
+    return bson_to_json(doc)
+
+# live feed of new logs as server-sent events, a comment line is sent every keep_alive seconds without data.
+# returns None when the broker is at its subscriber limit
+def subscribe_logs(db_interface:MongoDBInterface, device:Optional[str] = None, sensors:Optional[list[str]] = None, ir_format:str = "list", keep_alive:float = 15):
+    if ir_format not in IR_FORMATS:
+        raise InvalidQueryError(f"irFormat must be one of {IR_FORMATS}")
+    if db_interface.logBroker.is_full():
+        return None
+
+    async def generate():
+        # subscribed only once the response starts streaming, so an abandoned response never leaks a queue
+        subscription = db_interface.logBroker.subscribe(device, sensors)
+        if subscription is None:
+            return
+        try:
+            while True:
+                try:
+                    doc = await asyncio.wait_for(subscription.queue.get(), keep_alive)
+                except asyncio.TimeoutError:
+                    yield b": keep-alive\n\n"
+                    continue
+                yield b"data: " + encode_json(log_document_to_json(doc, ir_format)) + b"\n\n"
+        finally:
+            db_interface.logBroker.unsubscribe(subscription)
+
+    return generate()
+
 # reading device data
 async def read_device_info(db_interface:MongoDBInterface, object_id:str):
+    cache_key = ("info", object_id)
+    if db_interface.deviceCache is not None:
+        cached = db_interface.deviceCache.get(cache_key)
+        if cached is not None:
+            return cached
+
     object_id = ObjectId(object_id)
-    coll = db_interface.database[db_interface.collectionMapping["Devices"]]
-    return await coll.find_one({"_id": object_id})
+    generation = db_interface.deviceCacheGeneration
+    coll = db_interface.collection("Devices", db_interface.device_read_profile())
+    with timed("mongodb", "find_one"):
+        result = await coll.find_one({"_id": object_id})
+    if db_interface.deviceCache is not None and generation == db_interface.deviceCacheGeneration:
+        db_interface.deviceCache.set(cache_key, result)
+    return result
 
-# reading single Log data by ObjectId
-async def read_single_log(db_interface:MongoDBInterface, object_id:str):
+# reading single Log data by ObjectId, IR frames are expanded unless ir_format is "packed"
+async def read_single_log(db_interface:MongoDBInterface, object_id:str, ir_format:str = "list"):
+    if ir_format not in IR_FORMATS:
+        raise InvalidQueryError(f"irFormat must be one of {IR_FORMATS}")
     object_id = ObjectId(object_id)
-    coll = db_interface.database[db_interface.collectionMapping["Logs"]]
-    return await coll.find_one({"_id": object_id})
+    coll = db_interface.collection("Logs", READ_PROFILE)
+    with timed("mongodb", "find_one"):
+        result = await coll.find_one({"_id": object_id})
+    if result is not None and ir_format == "list":
+        expand_ir_frame(result)
+    return result
 
 # inserting/updating Device data
 async def insert_device(db_interface:MongoDBInterface, data: DeviceMeta):
     print(f"inserting data into devices collection: {data}")
-    coll = db_interface.database[db_interface.collectionMapping["Devices"]]
-    return await coll.find_one_and_replace({"device": data.device},data.to_dict(),upsert=True, return_document=True)
+    coll = db_interface.collection("Devices", DEVICE_PROFILE)
+    with timed("mongodb", "find_one_and_replace"):
+        result = await coll.find_one_and_replace({"device": data.device},data.to_dict(),upsert=True, return_document=True)
+    db_interface.invalidate_device_cache()
+    return result
+
+# Log document with its _id derived from (device, sensor, timestamp), see roomsense2.dedupe
+def log_document(data: TimeseriesLog):
+    document = data.to_dict()
+    document["_id"] = log_document_id(document)
+    return document
 
 # inserting/updating Log data
+# a log that is already stored (a retry) succeeds with the id of the stored one
 async def insert_log(db_interface:MongoDBInterface, data: TimeseriesLog):
     print(f"inserting data into logs collection: {data}")
-    coll = db_interface.database[db_interface.collectionMapping["Logs"]]
-    return await coll.insert_one(data.to_dict())
+    document = log_document(data)
+    if db_interface.logBuffer is not None:
+        inserted_id = await db_interface.logBuffer.submit(document)
+        return InsertOneResult(inserted_id, True)
+    coll = db_interface.collection("Logs", INGEST_PROFILE)
+    try:
+        with timed("mongodb", "insert_one"):
+            result = await coll.insert_one(document)
+    except DuplicateKeyError:
+        print(f"log {document['_id']} is already stored")
+        return InsertOneResult(document["_id"], True)
+    await after_logs_inserted(db_interface, [document])
+    return result
+
+# inserting many Log data in one unordered bulk write
+# returns the inserted id per item (None when that item failed) and the failures by index, already stored logs are not failures
+async def insert_logs(db_interface:MongoDBInterface, data: list[TimeseriesLog]):
+    print(f"inserting {len(data)} documents into logs collection")
+    coll = db_interface.collection("Logs", INGEST_PROFILE)
+    documents = [log_document(item) for item in data]
+    if len(documents) == 0:
+        return {"insertedIds": [], "failures": []}
+
+    failed, duplicates = await insert_documents(coll, documents)
+    await after_logs_inserted(db_interface, [document for index, document in enumerate(documents) if index not in failed and index not in duplicates])
+    # already stored logs count as inserted
+    inserted_ids = [None if index in failed else document["_id"] for index, document in enumerate(documents)]
+    failures = [{"index": index, "error": message} for index, message in sorted(failed.items())]
+    return {"insertedIds": inserted_ids, "failures": failures}
+
+# unordered insert_many that reports the error message of every failed document by its index,
+# and separately the indexes of documents that were already stored (duplicate key)
+async def insert_documents(coll, documents:list[dict]):
+    failed = dict()
+    duplicates = set()
+    try:
+        with timed("mongodb", "insert_many"):
+            await coll.insert_many(documents, ordered=False)
+    except BulkWriteError as e:
+        for error in e.details.get("writeErrors", []):
+            if error.get("code") == DUPLICATE_KEY_ERROR:
+                duplicates.add(error["index"])
+            else:
+                failed[error["index"]] = error.get("errmsg", "write error")
+    return failed, duplicates
+
+# called with the documents that were actually written by every ingest path
+async def after_logs_inserted(db_interface:MongoDBInterface, documents:list[dict]):
+    if len(documents) == 0:
+        return
+    for document in documents:
+        LOGS_INGESTED.inc(document["metadata"]["sensor"])
+    if not db_interface.changeStreamEnabled:
+        logs_observed(db_interface, documents)
+    if db_interface.rollupBuffer is not None:
+        await db_interface.rollupBuffer.add(documents)
+
+# new logs seen by this process, either its own inserts or the Logs change stream
+def logs_observed(db_interface:MongoDBInterface, documents:list[dict]):
+    db_interface.latestReadings.update(documents)
+    db_interface.logBroker.publish(documents)
 
+# runs until cancelled, reconnecting with a growing delay when the change stream fails
+async def watch_changes(db_interface:MongoDBInterface, key:str, pipeline:list[dict], on_change):
+    coll = db_interface.collection(key)
+    delay = 1
+    while True:
+        try:
+            async with coll.watch(pipeline) as stream:
+                delay = 1
+                async for change in stream:
+                    on_change(change)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            print(f"{key} change stream failed, retrying in {delay}s: {e}")
+            await asyncio.sleep(delay)
+            delay = min(delay * 2, 60)
 
+async def watch_log_changes(db_interface:MongoDBInterface):
+    await watch_changes(db_interface, "Logs", [{"$match": {"operationType": "insert"}}],
+                        lambda change: logs_observed(db_interface, [change["fullDocument"]]))
 
+# every change to Devices, whichever worker wrote it, clears this process's device cache
+async def watch_device_changes(db_interface:MongoDBInterface):
+    await watch_changes(db_interface, "Devices", [], lambda change: db_interface.invalidate_device_cache())
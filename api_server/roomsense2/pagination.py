@@ -0,0 +1,76 @@
+import base64
+import json
+from datetime import datetime
+from bson import ObjectId
+from bson.errors import InvalidId
+from roomsense2.errors import InvalidQueryError
+
+## opaque continuation tokens for keyset (seek) pagination
+# a token records the sort key of the last document of a page, the next page
+# starts strictly after it so every page is an index range scan instead of a skip
+
+# logs are ordered on (timestamp, _id), newest first unless the query asks for "asc"
+LOG_PAGE_ORDERS = ["desc", "asc"]
+# devices are ordered on _id
+DEVICE_PAGE_SORT = [("_id", 1)]
+
+
+def encode_page_token(values: dict) -> str:
+    raw = json.dumps(values, separators=(",", ":")).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip("=")
+
+def decode_page_token(token: str) -> dict:
+    try:
+        padded = token + "=" * (-len(token) % 4)
+        values = json.loads(base64.urlsafe_b64decode(padded.encode()))
+    except (ValueError, TypeError):
+        raise InvalidQueryError("malformed page token")
+    if not isinstance(values, dict):
+        raise InvalidQueryError("malformed page token")
+    return values
+
+
+def log_page_sort(order: str) -> list[tuple[str, int]]:
+    direction = 1 if order == "asc" else -1
+    return [("timestamp", direction), ("_id", direction)]
+
+def log_page_token(timestamp: datetime, object_id: ObjectId, order: str = "desc") -> str:
+    return encode_page_token({"t": timestamp.isoformat(), "id": str(object_id), "o": order})
+
+# a token only continues a listing in the order it was issued for
+def parse_log_page_token(token: str, order: str = "desc") -> tuple[datetime, ObjectId, str]:
+    values = decode_page_token(token)
+    try:
+        timestamp, object_id, token_order = datetime.fromisoformat(values["t"]), ObjectId(values["id"]), values.get("o", "desc")
+    except (KeyError, TypeError, ValueError, InvalidId):
+        raise InvalidQueryError("malformed page token")
+    if token_order != order:
+        raise InvalidQueryError("page token was issued for a different order")
+    return timestamp, object_id, token_order
+
+# filter matching the documents after (timestamp, object_id) in log_page_sort(order) order.
+# the top level timestamp bound is implied by the $or, it gives the planner a single tight index range
+def log_seek_filter(timestamp: datetime, object_id: ObjectId, order: str = "desc") -> dict:
+    after = "$gt" if order == "asc" else "$lt"
+    return {
+        "timestamp": {"$gte" if order == "asc" else "$lte": timestamp},
+        "$or": [
+            {"timestamp": {after: timestamp}},
+            {"timestamp": timestamp, "_id": {after: object_id}}
+        ]
+    }
+
+
+def device_page_token(object_id: ObjectId) -> str:
+    return encode_page_token({"id": str(object_id)})
+
+def parse_device_page_token(token: str) -> ObjectId:
+    values = decode_page_token(token)
+    try:
+        return ObjectId(values["id"])
+    except (KeyError, TypeError, InvalidId):
+        raise InvalidQueryError("malformed page token")
+
+# filter matching the documents after object_id in DEVICE_PAGE_SORT order
+def device_seek_filter(object_id: ObjectId) -> dict:
+    return {"_id": {"$gt": object_id}}
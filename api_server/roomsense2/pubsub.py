@@ -0,0 +1,53 @@
+import asyncio
+from typing import Optional
+
+# one live subscriber, a bounded queue of matching log documents.
+# a consumer that falls behind loses its oldest pending documents instead of holding up ingest
+class Subscription:
+
+    def __init__(self, device:Optional[str], sensors:Optional[list[str]], max_queue:int):
+        self.device = device
+        self.sensors = sensors
+        self.queue: asyncio.Queue[dict] = asyncio.Queue(maxsize=max_queue)
+        self.dropped = 0
+
+    def matches(self, document:dict):
+        metadata = document["metadata"]
+        if self.device is not None and metadata["device"] != self.device:
+            return False
+        return self.sensors is None or metadata["sensor"] in self.sensors
+
+    def offer(self, document:dict):
+        if self.queue.full():
+            self.queue.get_nowait()
+            self.dropped += 1
+        self.queue.put_nowait(document)
+
+
+# in-process fan out of freshly ingested logs to live subscribers
+class LogBroker:
+
+    def __init__(self, max_queue:int = 100, max_subscribers:int = 1000):
+        self.max_queue = max_queue
+        self.max_subscribers = max_subscribers
+        self.subscriptions: set[Subscription] = set()
+
+    def is_full(self):
+        return len(self.subscriptions) >= self.max_subscribers
+
+    # None once max_subscribers are connected
+    def subscribe(self, device:Optional[str] = None, sensors:Optional[list[str]] = None) -> Optional[Subscription]:
+        if self.is_full():
+            return None
+        subscription = Subscription(device, sensors, self.max_queue)
+        self.subscriptions.add(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription:Subscription):
+        self.subscriptions.discard(subscription)
+
+    def publish(self, documents:list[dict]):
+        for subscription in self.subscriptions:
+            for document in documents:
+                if subscription.matches(document):
+                    subscription.offer(document)
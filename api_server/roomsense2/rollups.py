@@ -0,0 +1,108 @@
+import datetime
+from pymongo import ASCENDING, IndexModel, UpdateOne
+from roomsense2.fmt import AGGREGATION_FIELDS
+from roomsense2.serialization import naive_utc
+
+## pre-aggregated rollups of numeric log fields
+# every rollup document holds count/sum/min/max per data field for one (device, sensor, bucket start),
+# they are upserted with $inc/$min/$max as logs are ingested so charts never rescan raw logs
+
+# (collection mapping key, bucket unit), finest first
+ROLLUP_RESOLUTIONS = [
+    ("RollupsMinute", "minute"),
+    ("RollupsHour", "hour"),
+    ("RollupsDay", "day"),
+]
+
+# $dateTrunc units that a rollup of the given unit can be regrouped into without splitting its buckets
+ROLLUP_COMPATIBLE_UNITS = {
+    "minute": ["minute", "hour", "day", "week", "month", "year"],
+    "hour": ["hour", "day", "week", "month", "year"],
+    "day": ["day", "week", "month", "year"],
+}
+
+ROLLUP_INDEXES = [
+    IndexModel([("device", ASCENDING), ("sensor", ASCENDING), ("start", ASCENDING)], name="device_sensor_start", unique=True),
+    IndexModel([("sensor", ASCENDING), ("start", ASCENDING)], name="sensor_start"),
+]
+
+
+def bucket_start(timestamp: datetime.datetime, unit: str) -> datetime.datetime:
+    timestamp = naive_utc(timestamp).replace(second=0, microsecond=0)
+    if unit in ("hour", "day"):
+        timestamp = timestamp.replace(minute=0)
+    if unit == "day":
+        timestamp = timestamp.replace(hour=0)
+    return timestamp
+
+def numeric_fields(data: dict | None) -> dict[str, float]:
+    if data is None:
+        return dict()
+    return {
+        field: value for field, value in data.items()
+        if field in AGGREGATION_FIELDS and isinstance(value, (int, float)) and not isinstance(value, bool)
+    }
+
+
+# folds the numeric fields of documents into buckets keyed by (device, sensor, bucket start), buckets
+# collected across several ingest batches cost a single upsert each
+def add_rollup_buckets(buckets: dict[tuple, dict], documents: list[dict], unit: str):
+    for document in documents:
+        fields = numeric_fields(document.get("data"))
+        if len(fields) == 0:
+            continue
+        metadata = document["metadata"]
+        key = (metadata["device"], metadata["sensor"], bucket_start(document["timestamp"], unit))
+        bucket = buckets.setdefault(key, {"count": dict(), "sum": dict(), "min": dict(), "max": dict()})
+        for field, value in fields.items():
+            bucket["count"][field] = bucket["count"].get(field, 0) + 1
+            bucket["sum"][field] = bucket["sum"].get(field, 0) + value
+            bucket["min"][field] = min(bucket["min"].get(field, value), value)
+            bucket["max"][field] = max(bucket["max"].get(field, value), value)
+
+# one upsert per bucket
+def bucket_updates(buckets: dict[tuple, dict]) -> list[UpdateOne]:
+    updates = list()
+    for (device, sensor, start), bucket in buckets.items():
+        inc = dict()
+        for field in bucket["count"]:
+            inc[f"count.{field}"] = bucket["count"][field]
+            inc[f"sum.{field}"] = bucket["sum"][field]
+        updates.append(UpdateOne(
+            {"device": device, "sensor": sensor, "start": start},
+            {
+                "$inc": inc,
+                "$min": {f"min.{field}": value for field, value in bucket["min"].items()},
+                "$max": {f"max.{field}": value for field, value in bucket["max"].items()},
+            },
+            upsert=True
+        ))
+    return updates
+
+def rollup_updates(documents: list[dict], unit: str) -> list[UpdateOne]:
+    buckets: dict[tuple, dict] = dict()
+    add_rollup_buckets(buckets, documents, unit)
+    return bucket_updates(buckets)
+
+
+# coarsest rollup whose buckets fit evenly into the requested $dateTrunc unit, None when only raw logs do
+def select_rollup(unit: str) -> tuple[str, str] | None:
+    for key, rollup_unit in reversed(ROLLUP_RESOLUTIONS):
+        if unit in ROLLUP_COMPATIBLE_UNITS[rollup_unit]:
+            return key, rollup_unit
+    return None
+
+# regroups rollup documents into the requested buckets, producing the same shape as the raw aggregation
+def rollup_pipeline(match: dict, field: str, unit: str, bin_size: int) -> list[dict]:
+    return [
+        {"$match": {**match, f"count.{field}": {"$gt": 0}}},
+        {"$group": {
+            "_id": {"$dateTrunc": {"date": "$start", "unit": unit, "binSize": bin_size}},
+            "min": {"$min": f"$min.{field}"},
+            "max": {"$max": f"$max.{field}"},
+            "sum": {"$sum": f"$sum.{field}"},
+            "count": {"$sum": f"$count.{field}"}
+        }},
+        {"$project": {"min": 1, "max": 1, "mean": {"$divide": ["$sum", "$count"]}, "count": 1}},
+        {"$sort": {"_id": 1}}
+    ]
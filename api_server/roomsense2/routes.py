@@ -0,0 +1,346 @@
+from fastapi import APIRouter, Depends, Query, Request, UploadFile
+from typing import Optional
+from fastapi.exceptions import HTTPException
+from fastapi.responses import PlainTextResponse, StreamingResponse
+from roomsense2.fmt import *
+from roomsense2.mongodb import *
+from roomsense2.errors import *
+from roomsense2.s3 import *
+from roomsense2.serialization import bson_to_json
+from roomsense2.metrics import REGISTRY
+
+router = APIRouter()
+
+# the interfaces are created per worker by the application lifespan (see roomsense2.app) and kept on app.state.
+# async so fastapi resolves them on the event loop instead of a threadpool hop per request
+async def get_mongodb_interface(request: Request) -> MongoDBInterface:
+    return request.app.state.mongodb_interface
+
+async def get_s3_interface(request: Request) -> S3Interface:
+    return request.app.state.s3_interface
+
+async def get_config(request: Request) -> dict:
+    return request.app.state.config
+
+
+# prometheus scrape endpoint, per worker process (see roomsense2.metrics)
+@router.get("/metrics", include_in_schema=False)
+async def metrics():
+    return PlainTextResponse(REGISTRY.render(), media_type="text/plain; version=0.0.4")
+
+
+## Single Retrival Requests
+# Requests for following routes will be done via GET method and request through the url
+
+@router.get("/v0/device/{object_id}")
+async def device(object_id: str, mongodb_interface: MongoDBInterface = Depends(get_mongodb_interface)):
+    response_wrapper = RetreivalResponse()
+    try:
+        result = await read_device_info(mongodb_interface,object_id) 
+        if result is None:
+            raise ItemNotFoundError
+        result["_id"] = str(result["_id"])
+        response_wrapper.set_status("success")
+        response_wrapper.result = result
+    except ItemNotFoundError:
+        response_wrapper.set_status("item(s) not found")
+    except Exception as e:
+        response_wrapper.set_status("internal server error")
+        print(e)
+    finally:
+        return response_wrapper.to_response() 
+
+# ?irFormat=packed returns IR frames as base64 int16 centi-degrees instead of a list
+@router.get("/v0/log/{object_id}")
+async def log(object_id: str, irFormat: str = "list", mongodb_interface: MongoDBInterface = Depends(get_mongodb_interface)):
+    response_wrapper = RetreivalResponse()
+    try:
+        result = await read_single_log(mongodb_interface,object_id,irFormat)
+        if result is None:
+            raise ItemNotFoundError
+        result["_id"] = str(result["_id"])
+        result["timestamp"] = str(result["timestamp"]) 
+        response_wrapper.set_status("success")
+        response_wrapper.result = bson_to_json(result)
+    except ItemNotFoundError:
+        response_wrapper.set_status("item(s) not found")
+    except InvalidQueryError as e:
+        response_wrapper.set_status(f"invalid query: {e}")
+    except Exception as e:
+        response_wrapper.set_status("internal server error")
+        print(e)
+    finally:
+        return response_wrapper.to_response()
+
+# latest log of every (device, sensor) pair, optionally narrowed with ?device=...&sensor=...&sensor=...
+@router.get("/v0/latest")
+async def latest_logs(device: Optional[str] = None, sensor: Optional[list[str]] = Query(None), irFormat: str = "list", mongodb_interface: MongoDBInterface = Depends(get_mongodb_interface)):
+    response_wrapper = RetreivalResponse()
+    try:
+        result = await read_latest_logs(mongodb_interface, device, sensor, irFormat)
+        response_wrapper.set_status("success")
+        response_wrapper.result = result
+    except InvalidQueryError as e:
+        response_wrapper.set_status(f"invalid query: {e}")
+    except Exception as e:
+        response_wrapper.set_status("internal server error")
+        print(e)
+    finally:
+        return response_wrapper.to_response()
+
+# server-sent events stream of new logs, same filters as /v0/latest
+@router.get("/v0/subscribe/log")
+async def subscribe_log(device: Optional[str] = None, sensor: Optional[list[str]] = Query(None), irFormat: str = "list", mongodb_interface: MongoDBInterface = Depends(get_mongodb_interface)):
+    try:
+        stream = subscribe_logs(mongodb_interface, device, sensor, irFormat)
+    except InvalidQueryError as e:
+        raise HTTPException(status_code=400, detail=f"invalid query: {e}")
+    if stream is None:
+        raise HTTPException(status_code=503, detail="too many subscribers")
+    return StreamingResponse(stream, media_type="text/event-stream", headers={"Cache-Control": "no-cache"})
+
+## Multi Retrival Routes
+# Requests for following routes will be done via POST method and request through the body
+#{
+# "userSetLocation": "optional"
+# "device" : optional (objectId)
+# "sensors" : optional
+# }
+
+@router.post("/v0/device")
+async def page_device(item: DeviceMultiRetreivalRequest, mongodb_interface: MongoDBInterface = Depends(get_mongodb_interface)):
+    response_wrapper = RetreivalResponse()
+    try:
+        result = await read_paginated_device(mongodb_interface,item)
+        response_wrapper.set_status("success")
+        response_wrapper.result = result
+    except InvalidQueryError as e:
+        response_wrapper.set_status(f"invalid query: {e}")
+    except Exception as e:
+        response_wrapper.set_status("internal server error")
+        print(e)
+    finally:
+        return response_wrapper.to_response()
+
+#{
+# "datetime": optional (inclusive upper bound, legacy)
+# "start": optional (inclusive)
+# "end": optional (exclusive)
+# "order": optional, desc | asc on timestamp (default desc)
+# "device" : optional (objectId)
+# "sensor" : optional
+# "cursor": optional (int offset, legacy)
+# "pageToken": optional (opaque token from "nextPageToken" of the previous page)
+# "limit": optional
+# "dataFields" : [brightness, temperature, humidity, imageUrl, audioUrl] # all uses same method with different filter
+# "fields": optional, e.g. [timestamp, data.co2] # projection, only these fields (plus _id and timestamp) are returned
+# "irFormat": optional, list | packed (default list)
+# "count": optional, adds {"total", "remaining", "capped"} to the result, counting stops at "countLimit" (default 10000)
+#}
+
+@router.post("/v0/log")
+async def page_logs(item: TimeseriesMultiRetreivalRequest, mongodb_interface: MongoDBInterface = Depends(get_mongodb_interface)):
+    response_wrapper = RetreivalResponse()
+    try: 
+        result = await read_paginated_logs(mongodb_interface,item)
+        response_wrapper.set_status("success")
+        response_wrapper.result = result
+    except InvalidQueryError as e:
+        response_wrapper.set_status(f"invalid query: {e}")
+    except Exception as e:
+        response_wrapper.set_status("internal server error")
+        print(e)
+    finally:
+        return response_wrapper.to_response()
+
+# same body as /v0/log, streams every matching log as newline-delimited JSON in the requested order
+# "cursor" is ignored, "limit" caps the export instead of the page size
+@router.post("/v0/log/export")
+async def export_logs(item: TimeseriesMultiRetreivalRequest, mongodb_interface: MongoDBInterface = Depends(get_mongodb_interface), config: dict = Depends(get_config)):
+    try:
+        stream = stream_logs(mongodb_interface, item, int(config.get("MONGODB_EXPORT_BATCH_SIZE", "1000")))
+    except InvalidQueryError as e:
+        raise HTTPException(status_code=400, detail=f"invalid query: {e}")
+    return StreamingResponse(stream, media_type="application/x-ndjson")
+
+#{
+# "field": co2 | temperature | humidity | brightness
+# "device": optional
+# "sensor": optional
+# "start": optional (inclusive)
+# "end": optional (exclusive)
+# "unit": optional, second | minute | hour | day | week | month | year (default hour)
+# "binSize": optional (default 1)
+# "source": optional, raw | rollup (default raw)
+#}
+
+@router.post("/v0/log/aggregate")
+async def aggregate_log(item: TimeseriesAggregationRequest, mongodb_interface: MongoDBInterface = Depends(get_mongodb_interface)):
+    response_wrapper = RetreivalResponse()
+    try:
+        result = await aggregate_logs(mongodb_interface, item)
+        response_wrapper.set_status("success")
+        response_wrapper.result = result
+    except InvalidQueryError as e:
+        response_wrapper.set_status(f"invalid query: {e}")
+    except Exception as e:
+        response_wrapper.set_status("internal server error")
+        print(e)
+    finally:
+        return response_wrapper.to_response()
+
+# Upload Requests
+# RabbitMq may be used to bulk upload to monogdb
+# following endpoint route them into queue (logs likely)
+
+@router.post("/update/device")
+async def upload_device(item: UploadDeviceRequest, mongodb_interface: MongoDBInterface = Depends(get_mongodb_interface)):
+#register device to mongodb
+    response_wrapper = MongodbUploadResponse() 
+    try:
+        result = await insert_device(mongodb_interface, item)
+        print(result)
+        if result is None:
+            raise UpdateFailError
+        if result["_id"] is not None:
+            response_wrapper.insertedId = str(result["_id"]) 
+        response_wrapper.set_status("success")
+    except UpdateFailError:
+        response_wrapper.set_status("update failed")
+    except Exception as e:
+        response_wrapper.set_status("internal server error")
+        print(e)
+    finally:
+        return response_wrapper.to_response()
+
+@router.post("/update/log")
+async def upload_log(item: UploadLogRequest, mongodb_interface: MongoDBInterface = Depends(get_mongodb_interface)):
+#validation will be done with sensor-field mapping
+    response_wrapper = MongodbUploadResponse() 
+    try:
+        result = await insert_log(mongodb_interface, item)
+
+        if result is None:
+            raise UpdateFailError
+        if result.inserted_id is not None:
+            response_wrapper.insertedId = str(result.inserted_id)
+        response_wrapper.set_status("success")
+    except UpdateFailError:
+        response_wrapper.set_status("update failed")
+    except Exception as e:
+        response_wrapper.set_status("internal server error")
+        print(e)
+    finally:
+        return response_wrapper.to_response()
+
+@router.post("/update/logs")
+async def upload_logs(items: UploadLogsRequest, mongodb_interface: MongoDBInterface = Depends(get_mongodb_interface)):
+#bulk variant of /update/log, a device can flush a whole window of readings in one request
+    if len(items) > MAX_BULK_UPLOAD_LOGS:
+        raise HTTPException(status_code=400, detail=f"too many logs in one request (max {MAX_BULK_UPLOAD_LOGS})")
+
+    response_wrapper = MongodbBulkUploadResponse()
+    try:
+        result = await insert_logs(mongodb_interface, items)
+        response_wrapper.insertedIds = [None if inserted_id is None else str(inserted_id) for inserted_id in result["insertedIds"]]
+        response_wrapper.failures = result["failures"]
+        if len(items) > 0 and len(result["failures"]) == len(items):
+            raise UpdateFailError
+        response_wrapper.set_status("success" if len(result["failures"]) == 0 else "partial success")
+    except UpdateFailError:
+        response_wrapper.set_status("update failed")
+    except Exception as e:
+        response_wrapper.set_status("internal server error")
+        print(e)
+    finally:
+        return response_wrapper.to_response()
+
+@router.post("/upload/image")
+#generate UUID with blob data using hash to ensure no duplicates
+#metadata required to be called after upload (/upload/image/raw)
+async def upload_image(file: UploadFile, s3_interface: S3Interface = Depends(get_s3_interface)):
+        
+    # check the content type (MIME type)
+    content_type = file.content_type
+    if "image" not in content_type:
+        raise HTTPException(status_code=400, detail="invalid file type (images only)")
+    
+    response_wrapper = S3UploadResponse() 
+    try:
+        result = await upload_s3_image(s3_interface, file)
+        response_wrapper.link = result
+        response_wrapper.set_status("success")
+    except UploadFailError:
+        response_wrapper.set_status("upload failed")
+    except Exception as e:
+        response_wrapper.set_status("internal server error")
+        print(e)
+    finally:
+        return response_wrapper.to_response()
+
+
+
+@router.post("/upload/audio")
+#generate UUID with blob data using hash to ensure no duplicates
+#metadata required to be called after upload (/upload/audio/raw)
+async def upload_audio(file: UploadFile, s3_interface: S3Interface = Depends(get_s3_interface)):
+
+    # check the content type (MIME type)
+    content_type = file.content_type
+    if "audio" not in content_type:
+        raise HTTPException(status_code=400, detail="invalid file type (audio only)")
+
+    response_wrapper = S3UploadResponse() 
+    try:
+        result = await upload_s3_audio(s3_interface, file )
+        response_wrapper.link = result
+        response_wrapper.set_status("success")
+    except UploadFailError:
+        response_wrapper.set_status("upload failed")
+    except Exception as e:
+        response_wrapper.set_status("internal server error")
+        print(e)
+    finally:
+        return response_wrapper.to_response()
+
+# Presigned Upload Requests
+# devices PUT media straight to the bucket: presign -> PUT to "url" with "headers" -> finalize
+#{
+# "kind": image | audio
+# "sha256": hex digest of the file
+# "extension": file extension
+# "contentType": optional
+#}
+
+@router.post("/upload/presign")
+async def presign_upload(item: PresignedUploadRequest, s3_interface: S3Interface = Depends(get_s3_interface), config: dict = Depends(get_config)):
+    response_wrapper = S3PresignResponse()
+    try:
+        response_wrapper.presigned = await presign_s3_upload(
+            s3_interface, MEDIA_BUCKET_KEYS[item.kind], item.sha256, item.extension, item.contentType,
+            int(config.get("AWS_PRESIGN_EXPIRES_SECONDS", "900"))
+        )
+        response_wrapper.set_status("success")
+    except UploadFailError:
+        response_wrapper.set_status("upload failed")
+    except Exception as e:
+        response_wrapper.set_status("internal server error")
+        print(e)
+    finally:
+        return response_wrapper.to_response()
+
+@router.post("/upload/finalize")
+async def finalize_upload(item: PresignedFinalizeRequest, s3_interface: S3Interface = Depends(get_s3_interface)):
+    response_wrapper = S3UploadResponse()
+    try:
+        response_wrapper.link = await finalize_s3_upload(s3_interface, MEDIA_BUCKET_KEYS[item.kind], item.sha256, item.extension)
+        response_wrapper.set_status("success")
+    except ItemNotFoundError:
+        response_wrapper.set_status("item(s) not found")
+    except UploadFailError:
+        response_wrapper.set_status("upload failed")
+    except Exception as e:
+        response_wrapper.set_status("internal server error")
+        print(e)
+    finally:
+        return response_wrapper.to_response()
@@ -1,28 +1,80 @@
+import asyncio
+import base64
 import boto3
+import functools
 import hashlib
+import uuid
+from boto3.exceptions import S3UploadFailedError
+from boto3.s3.transfer import TransferConfig
+from botocore.config import Config
 from botocore.exceptions import ClientError
+from concurrent.futures import ThreadPoolExecutor
 from typing import Optional
 from roomsense2.errors import * 
+from roomsense2.media import MediaIndex
+from roomsense2.metrics import timed
 from fastapi import UploadFile
 
+# uploads land under this prefix until their content hash is known (an expiry lifecycle rule on it cleans up orphans)
+UPLOAD_TEMP_PREFIX = "tmp/"
+# read size used when hashing files
+HASH_CHUNK_SIZE = 1024 * 1024
+
 class S3Interface:
 
     collectionMapping : dict[str,str] = dict()
     region: Optional[str] = None
+    endpointUrl: Optional[str] = None
+    mediaIndex: Optional[MediaIndex] = None
 
-    def __init__(self, access_key_id:str, secret_access_key:str, region:str | None):
+    # boto3 is synchronous, every call goes through a bounded thread pool of max_concurrency workers
+    # so uploads never block the event loop. bodies above multipart_threshold bytes use multipart upload
+    # endpoint_url points the client at an S3 compatible stand-in (MinIO, moto server) instead of AWS.
+    # max_pool_connections sizes the botocore connection pool shared by those workers and multipart transfers.
+    # requests are signed with SigV4 against the regional endpoint so presigned uploads sign their checksum header
+    # (SigV2 would leave it an unsigned query parameter), a custom endpoint is addressed by path instead
+    def __init__(self, access_key_id:str, secret_access_key:str, region:str | None, max_concurrency:int = 4, multipart_threshold:int = 8 * 1024 * 1024, endpoint_url:str | None = None,
+                 max_pool_connections:int = 10, connect_timeout:float = 60, read_timeout:float = 60):
+        client_endpoint_url = endpoint_url
+        if endpoint_url is None and region is not None:
+            client_endpoint_url = f"https://s3.{region}.amazonaws.com"
         self.client = boto3.client(
             's3',
             aws_access_key_id=access_key_id,
             aws_secret_access_key=secret_access_key,
-            region_name=region
+            region_name=region,
+            endpoint_url=client_endpoint_url,
+            config=Config(
+                signature_version="s3v4",
+                s3={"addressing_style": "virtual" if endpoint_url is None else "path"},
+                max_pool_connections=max_pool_connections,
+                connect_timeout=connect_timeout,
+                read_timeout=read_timeout
+            )
         )
+        self.collectionMapping = dict()
         if region is not None:
             self.region = region
+        if endpoint_url is not None:
+            self.endpointUrl = endpoint_url
+        self.executor = ThreadPoolExecutor(max_workers=max_concurrency, thread_name_prefix="s3")
+        self.transferConfig = TransferConfig(multipart_threshold=multipart_threshold)
     
     def set_collection_mapping(self, key:str, value:str):
         self.collectionMapping[key] = value
 
+    # consult the content addressed media index before uploading, duplicates then skip S3 entirely
+    def set_media_index(self, media_index:MediaIndex):
+        self.mediaIndex = media_index
+
+    async def run(self, func, *args, **kwargs):
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self.executor, functools.partial(func, *args, **kwargs))
+
+    def close(self):
+        self.executor.shutdown(wait=True)
+        self.client.close()
+
 
 ## helper methods that uses mongodb interface for local application
 async def upload_s3_image(s3_interface:S3Interface, file_obj: UploadFile):
@@ -32,17 +84,130 @@ async def upload_s3_audio(s3_interface:S3Interface, file_obj: UploadFile):
     return await upload_s3_file(s3_interface,"Audios", file_obj)
 
 async def upload_s3_file(s3_interface:S3Interface,bucket_key:str, file_obj: UploadFile):
-    s3 = s3_interface.client
     bucket_name = s3_interface.collectionMapping[bucket_key]
+    extension = get_file_extension(file_obj)
     try:
-        new_file_name = f"{await generate_hash(file_obj)}.{get_file_extension(file_obj)}"
-        s3.put_object(Body=file_obj.file,Bucket=bucket_name,Key=new_file_name)
-        return dynamic_aws_url(bucket_name, new_file_name, s3_interface.region)
-    except ClientError as e:
+        if s3_interface.mediaIndex is None:
+            new_file_name = await s3_interface.run(stream_upload, s3_interface, file_obj.file, bucket_name, extension)
+            return object_url(s3_interface, bucket_name, new_file_name)
+
+        # the hash is needed before the upload to look it up, the body is then put straight under its final key
+        new_file_name = f"{await s3_interface.run(hash_file, file_obj.file)}.{extension}"
+        link = await s3_interface.mediaIndex.acquire(bucket_name, new_file_name)
+        if link is not None:
+            return link
+        with timed("s3", "upload"):
+            await s3_interface.run(s3_interface.client.upload_fileobj, file_obj.file, bucket_name, new_file_name, Config=s3_interface.transferConfig)
+        link = object_url(s3_interface, bucket_name, new_file_name)
+        await s3_interface.mediaIndex.register(bucket_name, new_file_name, link)
+        return link
+    except (ClientError, S3UploadFailedError) as e:
         print(f"Error uploading log to S3 bucket {bucket_name}: {e}")
         raise UploadFailError
         
+# blocking, single pass over the file: the body is hashed while it streams to a temporary key,
+# then copied server side to its content hash key. returns the final key
+def stream_upload(s3_interface:S3Interface, file, bucket_name:str, extension:str):
+    s3 = s3_interface.client
+    temp_key = f"{UPLOAD_TEMP_PREFIX}{uuid.uuid4().hex}.{extension}"
+    reader = HashingReader(file)
+    try:
+        with timed("s3", "upload"):
+            s3.upload_fileobj(reader, bucket_name, temp_key, Config=s3_interface.transferConfig)
+        new_file_name = f"{reader.hexdigest()}.{extension}"
+        with timed("s3", "copy"):
+            s3.copy({"Bucket": bucket_name, "Key": temp_key}, bucket_name, new_file_name, Config=s3_interface.transferConfig)
+    finally:
+        try:
+            s3.delete_object(Bucket=bucket_name, Key=temp_key)
+        except ClientError as e:
+            print(f"Error removing temporary upload {temp_key} from S3 bucket {bucket_name}: {e}")
+    return new_file_name
+
+# read-only file wrapper hashing everything read through it
+# deliberately not seekable so boto3 consumes it strictly sequentially, in part sized reads
+class HashingReader:
+
+    def __init__(self, file):
+        self.file = file
+        self.hash_obj = hashlib.sha256()
+
+    def read(self, size:int = -1):
+        data = self.file.read(size)
+        self.hash_obj.update(data)
+        return data
+
+    def hexdigest(self):
+        return self.hash_obj.hexdigest()
+
+# presigned PUT for a device to upload media straight to the bucket under its content hash key.
+# the SHA-256 checksum header is part of the SigV4 signature so S3 rejects any body that does not match the hash.
+# "exists" tells the device the object is already stored and the upload can be skipped
+async def presign_s3_upload(s3_interface:S3Interface, bucket_key:str, digest:str, extension:str, content_type:str | None, expires_in:int = 900):
+    bucket_name = s3_interface.collectionMapping[bucket_key]
+    new_file_name = f"{digest}.{extension}"
+    link = object_url(s3_interface, bucket_name, new_file_name)
+    if s3_interface.mediaIndex is not None and await s3_interface.mediaIndex.lookup(bucket_name, new_file_name) is not None:
+        return {"exists": True, "key": new_file_name, "link": link}
+
+    checksum = base64.b64encode(bytes.fromhex(digest)).decode()
+    params = {"Bucket": bucket_name, "Key": new_file_name, "ChecksumSHA256": checksum}
+    headers = {"x-amz-checksum-sha256": checksum}
+    if content_type is not None:
+        params["ContentType"] = content_type
+        headers["Content-Type"] = content_type
+    try:
+        url = await s3_interface.run(s3_interface.client.generate_presigned_url, "put_object", Params=params, ExpiresIn=expires_in)
+    except ClientError as e:
+        print(f"Error presigning upload to S3 bucket {bucket_name}: {e}")
+        raise UploadFailError
+    return {"exists": False, "key": new_file_name, "link": link, "url": url, "headers": headers, "expiresIn": expires_in}
+
+# called by the device once its presigned upload succeeded, registers the object and returns its link.
+# the stored object must hash to the claimed digest, otherwise it is never registered (a later correct PUT overwrites it)
+async def finalize_s3_upload(s3_interface:S3Interface, bucket_key:str, digest:str, extension:str):
+    bucket_name = s3_interface.collectionMapping[bucket_key]
+    new_file_name = f"{digest}.{extension}"
+    if s3_interface.mediaIndex is not None:
+        link = await s3_interface.mediaIndex.acquire(bucket_name, new_file_name)
+        if link is not None:
+            return link
+    try:
+        verified = await s3_interface.run(object_has_digest, s3_interface, bucket_name, new_file_name, digest)
+    except ClientError as e:
+        print(f"Presigned upload {new_file_name} not found in S3 bucket {bucket_name}: {e}")
+        raise ItemNotFoundError
+    if not verified:
+        print(f"Presigned upload {new_file_name} in S3 bucket {bucket_name} does not match its digest")
+        raise UploadFailError
+    link = object_url(s3_interface, bucket_name, new_file_name)
+    if s3_interface.mediaIndex is not None:
+        await s3_interface.mediaIndex.register(bucket_name, new_file_name, link)
+    return link
+
+# blocking, True when the stored object hashes to digest. the full object SHA-256 checksum S3 recorded for a
+# presigned upload is compared directly, objects without one (or with a multipart composite one) are streamed and hashed
+def object_has_digest(s3_interface:S3Interface, bucket_name:str, key:str, digest:str):
+    s3 = s3_interface.client
+    with timed("s3", "head_object"):
+        head = s3.head_object(Bucket=bucket_name, Key=key, ChecksumMode="ENABLED")
+    checksum = head.get("ChecksumSHA256")
+    if checksum is not None and "-" not in checksum:
+        return checksum == base64.b64encode(bytes.fromhex(digest)).decode()
+
+    hash_obj = hashlib.sha256()
+    with timed("s3", "get_object"):
+        body = s3.get_object(Bucket=bucket_name, Key=key)["Body"]
+        for chunk in body.iter_chunks(HASH_CHUNK_SIZE):
+            hash_obj.update(chunk)
+    return hash_obj.hexdigest() == digest
+
 #general s3 helpers
+def object_url(s3_interface:S3Interface, bucket_name:str, file_name:str):
+    if s3_interface.endpointUrl is not None:
+        return f"{s3_interface.endpointUrl.rstrip('/')}/{bucket_name}/{file_name}"
+    return dynamic_aws_url(bucket_name, file_name, s3_interface.region)
+
 def dynamic_aws_url(bucket_name:str, file_name:str, region:str| None):
     if region is not None:
         return f"https://{bucket_name}.s3.{region}.amazonaws.com/{file_name}"
@@ -51,14 +216,13 @@ def dynamic_aws_url(bucket_name:str, file_name:str, region:str| None):
 def get_file_extension(file_obj):
     return file_obj.filename.split(".")[-1]
 
-#helper for generating has from file data
-async def generate_hash(file_obj):
-
+# blocking, reads the file from its current position and rewinds it to the start
+def hash_file(file):
     hash_obj = hashlib.sha256()
     while True:
-        data = file_obj.file.read(1024)
+        data = file.read(HASH_CHUNK_SIZE)
         if not data:
             break
         hash_obj.update(data)
-    await file_obj.seek(0)   
-    return hash_obj.hexdigest()
\ No newline at end of file
+    file.seek(0)
+    return hash_obj.hexdigest()
@@ -0,0 +1,54 @@
+import base64
+import datetime
+import orjson
+import tomli
+from functools import cache
+from typing import Any
+from bson import Binary, Decimal128, ObjectId
+from fastapi.responses import Response
+
+
+# api version is read from pyproject.toml once per process instead of on every response
+@cache
+def api_version() -> str:
+    with open('pyproject.toml', 'rb') as toml_file:
+        pyproject_data = tomli.load(toml_file)
+        return pyproject_data['tool']['poetry']['version']
+
+
+# mongodb stores naive UTC datetimes, aware ones are converted to that so they compare with what motor returns
+def naive_utc(timestamp: datetime.datetime) -> datetime.datetime:
+    if timestamp.tzinfo is not None:
+        timestamp = timestamp.astimezone(datetime.timezone.utc).replace(tzinfo=None)
+    return timestamp
+
+
+# converts a document returned by motor into JSON-ready python types in a single walk
+# datetimes are rendered the way the routes always did (str of the naive UTC datetime motor returns)
+def bson_to_json(value: Any) -> Any:
+    if isinstance(value, dict):
+        return {key: bson_to_json(item) for key, item in value.items()}
+    if isinstance(value, list):
+        return [bson_to_json(item) for item in value]
+    if isinstance(value, ObjectId):
+        return str(value)
+    if isinstance(value, datetime.datetime):
+        return str(value)
+    if isinstance(value, Binary) or isinstance(value, bytes):
+        return base64.b64encode(value).decode()
+    if isinstance(value, Decimal128):
+        return str(value)
+    return value
+
+
+# NaN and infinite floats are encoded as null
+def encode_json(content: Any) -> bytes:
+    return orjson.dumps(content, default=str)
+
+
+# response whose body is encoded directly, skipping FastAPI's jsonable_encoder pass
+class FastJSONResponse(Response):
+    media_type = "application/json"
+
+    def render(self, content: Any) -> bytes:
+        return encode_json(content)
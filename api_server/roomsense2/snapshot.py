@@ -0,0 +1,37 @@
+import datetime
+import time
+from typing import Optional
+from roomsense2.serialization import naive_utc
+
+# most recent log per (device, sensor), kept in memory and updated by every ingest
+# so the latest-reading snapshot never depends on how much history is stored
+class LatestReadings:
+
+    def __init__(self):
+        self.table: dict[tuple[str, str], dict] = dict()
+        # monotonic time of the last load from mongodb, None until the table has been warmed
+        self.warmedAt: Optional[float] = None
+        # newest log timestamp a load from mongodb returned, the next reload only reads logs from around there on
+        self.loadedUntil: Optional[datetime.datetime] = None
+
+    def is_warm(self):
+        return self.warmedAt is not None
+
+    def mark_warm(self):
+        self.warmedAt = time.monotonic()
+
+    def update(self, documents:list[dict]):
+        for document in documents:
+            metadata = document["metadata"]
+            key = (metadata["device"], metadata["sensor"])
+            # mongodb hands back naive UTC datetimes, keep ingested ones comparable with those
+            timestamp = naive_utc(document["timestamp"])
+            current = self.table.get(key)
+            if current is None or timestamp >= current["timestamp"]:
+                self.table[key] = {**document, "timestamp": timestamp}
+
+    def snapshot(self, device:Optional[str] = None, sensors:Optional[list[str]] = None) -> list[dict]:
+        return [
+            document for (doc_device, doc_sensor), document in sorted(self.table.items())
+            if (device is None or doc_device == device) and (sensors is None or doc_sensor in sensors)
+        ]
@@ -0,0 +1,27 @@
+import asyncio
+import inspect
+
+import pytest
+from mongomock_motor import AsyncMongoMockClient
+
+from roomsense2.mongodb import MongoDBInterface
+
+
+# async def tests run in their own event loop, no pytest plugin needed
+@pytest.hookimpl(tryfirst=True)
+def pytest_pyfunc_call(pyfuncitem):
+    if not inspect.iscoroutinefunction(pyfuncitem.obj):
+        return None
+    arguments = {name: pyfuncitem.funcargs[name] for name in pyfuncitem._fixtureinfo.argnames}
+    asyncio.run(pyfuncitem.obj(**arguments))
+    return True
+
+
+# interface over an in-memory mongomock client, every collection mapped to its key.
+# tests enable the optional parts (buffers, caches, rollups) they need on it
+@pytest.fixture
+def mongodb_interface():
+    mongodb_interface = MongoDBInterface("mongodb://localhost", "test", AsyncMongoMockClient())
+    for key in ("Logs", "Devices", "Media", "RollupsMinute", "RollupsHour", "RollupsDay"):
+        mongodb_interface.set_collection_mapping(key, key)
+    return mongodb_interface
@@ -0,0 +1,62 @@
+import gzip
+import json
+
+import httpx
+import zstandard
+from fastapi import APIRouter, FastAPI, Request
+
+from roomsense2.compression import THREADPOOL_MIN_SIZE, CompressionMiddleware
+from roomsense2.metrics import REQUEST_LATENCY, REQUEST_SIZE, MetricsMiddleware
+
+router = APIRouter()
+
+@router.post("/update/echo")
+async def echo(request: Request):
+    return {"size": len(await request.body())}
+
+@router.get("/v0/blob")
+async def blob():
+    return {"data": "x" * (2 * THREADPOOL_MIN_SIZE)}
+
+
+# same middleware order as the app factory
+def create_test_app():
+    app = FastAPI()
+    app.add_middleware(CompressionMiddleware)
+    app.add_middleware(MetricsMiddleware)
+    app.include_router(router)
+    return app
+
+async def request(method:str, url:str, **kwargs):
+    transport = httpx.ASGITransport(app=create_test_app())
+    async with httpx.AsyncClient(transport=transport, base_url="http://test") as client:
+        return await client.request(method, url, **kwargs)
+
+
+async def test_compressed_request_keeps_its_route_and_wire_size():
+    payload = json.dumps({"data": "y" * (2 * THREADPOOL_MIN_SIZE)}).encode()
+    for encoding, body in [("gzip", gzip.compress(payload)), ("zstd", zstandard.ZstdCompressor().compress(payload))]:
+        before = REQUEST_LATENCY.values.get(("POST", "/update/echo", "200"), [None, 0.0, 0])[2]
+        sizes_before = REQUEST_SIZE.values.get(("/update/echo",), [None, 0.0, 0])[1]
+
+        response = await request("POST", "/update/echo", content=body, headers={"content-encoding": encoding})
+
+        assert response.status_code == 200
+        assert response.json() == {"size": len(payload)}
+        assert REQUEST_LATENCY.values[("POST", "/update/echo", "200")][2] == before + 1
+        assert REQUEST_SIZE.values[("/update/echo",)][1] == sizes_before + len(body)
+
+async def test_unsupported_request_encoding_is_rejected():
+    response = await request("POST", "/update/echo", content=b"{}", headers={"content-encoding": "br"})
+    assert response.status_code == 415
+
+async def test_rejection_detail_is_escaped():
+    response = await request("POST", "/update/echo", content=b"{}", headers={"content-encoding": 'foo"bar'})
+    assert response.status_code == 415
+    assert response.json() == {"detail": 'unsupported content encoding foo"bar'}
+
+async def test_large_response_is_compressed():
+    for encoding in ("zstd", "gzip"):
+        response = await request("GET", "/v0/blob", headers={"accept-encoding": encoding})
+        assert response.headers["content-encoding"] == encoding
+        assert len(response.json()["data"]) == 2 * THREADPOOL_MIN_SIZE
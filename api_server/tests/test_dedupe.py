@@ -0,0 +1,104 @@
+import asyncio
+
+from roomsense2.common_types import TimeseriesLog
+from roomsense2.metrics import LOGS_INGESTED
+from roomsense2.mongodb import MongoDBInterface, ensure_indexes, insert_log, insert_logs, log_document
+
+
+def create_log(timestamp:str, co2:float = 400, device:str = "device-1"):
+    return TimeseriesLog.model_validate({
+        "timestamp": timestamp,
+        "metadata": {"device": device, "sensor": "s8"},
+        "data": {"co2": co2, "humidity": 40, "temperature": 21}
+    })
+
+# logs counted by the ingest metric and published to a live subscriber, i.e. reported by after_logs_inserted
+class IngestObserver:
+
+    def __init__(self, mongodb_interface:MongoDBInterface):
+        self.subscription = mongodb_interface.logBroker.subscribe()
+        self.ingested = LOGS_INGESTED.values.get(("s8",), 0)
+
+    def published(self):
+        return self.subscription.queue.qsize()
+
+    def counted(self):
+        return LOGS_INGESTED.values.get(("s8",), 0) - self.ingested
+
+
+def test_id_is_the_same_for_every_timezone_representation():
+    ids = {log_document(create_log(timestamp))["_id"] for timestamp in [
+        "2024-03-01T08:00:00",
+        "2024-03-01T08:00:00Z",
+        "2024-03-01T08:00:00+00:00",
+        "2024-03-01T10:00:00+02:00",
+        "2024-03-01T03:30:00-04:30",
+    ]}
+    assert len(ids) == 1
+
+def test_id_follows_the_stored_millisecond():
+    same = log_document(create_log("2024-03-01T08:00:00.123001"))["_id"]
+    assert log_document(create_log("2024-03-01T08:00:00.123999"))["_id"] == same
+    assert log_document(create_log("2024-03-01T08:00:00.124000"))["_id"] != same
+
+def test_id_ignores_the_data():
+    first = log_document(create_log("2024-03-01T08:00:00", co2=400))["_id"]
+    assert log_document(create_log("2024-03-01T08:00:00", co2=900))["_id"] == first
+    assert log_document(create_log("2024-03-01T08:00:00", device="device-2"))["_id"] != first
+
+
+async def test_single_insert_of_a_duplicate_succeeds_with_the_stored_id(mongodb_interface):
+    await ensure_indexes(mongodb_interface)
+    observer = IngestObserver(mongodb_interface)
+
+    first = await insert_log(mongodb_interface, create_log("2024-03-01T08:00:00Z"))
+    retry = await insert_log(mongodb_interface, create_log("2024-03-01T10:00:00+02:00"))
+
+    assert retry.acknowledged and retry.inserted_id == first.inserted_id
+    assert await mongodb_interface.collection("Logs").count_documents({}) == 1
+    assert observer.published() == 1 and observer.counted() == 1
+
+async def test_bulk_insert_reports_duplicates_as_inserted(mongodb_interface):
+    await ensure_indexes(mongodb_interface)
+    stored = await insert_log(mongodb_interface, create_log("2024-03-01T08:00:00"))
+    observer = IngestObserver(mongodb_interface)
+
+    result = await insert_logs(mongodb_interface, [
+        create_log("2024-03-01T08:00:00.000400"),
+        create_log("2024-03-01T08:00:01"),
+        create_log("2024-03-01T08:00:01"),
+    ])
+
+    assert result["failures"] == []
+    assert result["insertedIds"][0] == stored.inserted_id
+    assert result["insertedIds"][1] == result["insertedIds"][2] is not None
+    assert await mongodb_interface.collection("Logs").count_documents({}) == 2
+    assert observer.published() == 1 and observer.counted() == 1
+
+async def test_buffered_insert_of_a_duplicate_succeeds_with_the_stored_id(mongodb_interface):
+    mongodb_interface.enable_log_buffer(max_size=10, max_delay=0.01)
+    await ensure_indexes(mongodb_interface)
+    stored = await insert_log(mongodb_interface, create_log("2024-03-01T08:00:00Z"))
+    observer = IngestObserver(mongodb_interface)
+
+    results = await asyncio.gather(
+        insert_log(mongodb_interface, create_log("2024-03-01T09:00:00+01:00")),
+        insert_log(mongodb_interface, create_log("2024-03-01T08:00:02")),
+        insert_log(mongodb_interface, create_log("2024-03-01T08:00:02")),
+    )
+
+    assert results[0].inserted_id == stored.inserted_id
+    assert results[1].inserted_id == results[2].inserted_id
+    assert await mongodb_interface.collection("Logs").count_documents({}) == 2
+    assert observer.published() == 1 and observer.counted() == 1
+    await mongodb_interface.close()
+
+async def test_duplicate_devices_do_not_hold_up_the_other_device_indexes(mongodb_interface):
+    devices = mongodb_interface.collection("Devices")
+    await devices.insert_many([{"device": "device-1"}, {"device": "device-1"}])
+    await ensure_indexes(mongodb_interface)
+
+    indexes = await devices.index_information()
+    assert "device_unique" not in indexes
+    assert {"user_set_location", "sensors"} <= set(indexes)
+    assert "device_sensor_timestamp_unique" in await mongodb_interface.collection("Logs").index_information()
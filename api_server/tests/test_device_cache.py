@@ -0,0 +1,96 @@
+import asyncio
+
+from roomsense2.common_types import DeviceMeta
+from roomsense2.fmt import DeviceMultiRetreivalRequest
+from roomsense2.mongodb import DEVICE_PROFILE, READ_PROFILE, MongoDBInterface, insert_device, read_device_info, read_paginated_device
+
+
+# records the profile of every collection lookup in mongodb_interface.profilesUsed
+def record_profiles(mongodb_interface:MongoDBInterface):
+    collection = mongodb_interface.collection
+    mongodb_interface.profilesUsed = list()
+
+    def recording_collection(key:str, profile = None):
+        mongodb_interface.profilesUsed.append(profile)
+        return collection(key, profile)
+
+    mongodb_interface.collection = recording_collection
+
+# stands in for a Devices change stream (mongomock has none), yields the changes put on its queue
+class FakeChangeStream:
+
+    def __init__(self):
+        self.changes = asyncio.Queue()
+
+    def watch(self, pipeline):
+        return self
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc_info):
+        return False
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        return await self.changes.get()
+
+
+async def test_cache_is_refilled_from_the_primary_after_a_device_write(mongodb_interface):
+    record_profiles(mongodb_interface)
+    mongodb_interface.enable_device_cache(primary_window=60)
+    object_id = str((await insert_device(mongodb_interface, DeviceMeta(device="device-1", userSetLocation="kitchen")))["_id"])
+
+    mongodb_interface.profilesUsed.clear()
+    assert (await read_device_info(mongodb_interface, object_id))["userSetLocation"] == "kitchen"
+    await read_paginated_device(mongodb_interface, DeviceMultiRetreivalRequest())
+    assert mongodb_interface.profilesUsed == [DEVICE_PROFILE, DEVICE_PROFILE]
+
+    mongodb_interface.profilesUsed.clear()
+    assert (await read_device_info(mongodb_interface, object_id))["userSetLocation"] == "kitchen"
+    assert mongodb_interface.profilesUsed == []
+
+async def test_reads_go_back_to_the_read_profile_after_the_window(mongodb_interface):
+    record_profiles(mongodb_interface)
+    mongodb_interface.enable_device_cache(primary_window=0)
+    object_id = str((await insert_device(mongodb_interface, DeviceMeta(device="device-1")))["_id"])
+
+    mongodb_interface.profilesUsed.clear()
+    await read_device_info(mongodb_interface, object_id)
+    assert mongodb_interface.profilesUsed == [READ_PROFILE]
+
+async def test_read_overlapping_a_write_is_not_cached(mongodb_interface):
+    mongodb_interface.enable_device_cache()
+    object_id = (await insert_device(mongodb_interface, DeviceMeta(device="device-1")))["_id"]
+
+    coll = mongodb_interface.collection("Devices", mongodb_interface.device_read_profile())
+    find_one = coll.find_one
+
+    # a device write lands while the read is in flight
+    async def find_one_during_write(*args, **kwargs):
+        result = await find_one(*args, **kwargs)
+        await mongodb_interface.collection("Devices").update_one({"_id": object_id}, {"$set": {"userSetLocation": "office"}})
+        mongodb_interface.invalidate_device_cache()
+        return result
+
+    coll.find_one = find_one_during_write
+    assert (await read_device_info(mongodb_interface, str(object_id)))["userSetLocation"] is None
+    assert mongodb_interface.deviceCache.stats()["size"] == 0
+
+async def test_device_change_stream_clears_the_cache_for_writes_of_other_workers(mongodb_interface):
+    stream = FakeChangeStream()
+    mongodb_interface.collection("Devices").watch = stream.watch
+    mongodb_interface.enable_device_cache()
+    mongodb_interface.enable_change_stream()
+    mongodb_interface.start_change_stream()
+    mongodb_interface.deviceCache.set(("page", "{}"), {"devices": []})
+
+    # another worker updated a device
+    await stream.changes.put({"operationType": "update"})
+    await asyncio.sleep(0.01)
+    assert mongodb_interface.deviceCache.get(("page", "{}")) is None
+
+    await mongodb_interface.close()
+    assert mongodb_interface.deviceChangeStreamTask is None
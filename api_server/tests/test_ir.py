@@ -0,0 +1,63 @@
+import base64
+
+import pytest
+from bson import Binary
+from pydantic import ValidationError
+
+from roomsense2.common_types import IRImage
+from roomsense2.ir import IR_FRAME_SCALE, expand_ir_frame, pack_frame, unpack_frame
+
+
+def test_round_trip_keeps_centi_degrees():
+    frame = [21.37, -12.5, 0.0, 299.99, -40.01]
+    packed = pack_frame(frame)
+    assert len(packed) == 2 * len(frame)
+    assert unpack_frame(packed) == frame
+
+def test_packing_rounds_to_the_nearest_step():
+    assert unpack_frame(pack_frame([21.374, 21.376])) == [21.37, 21.38]
+
+def test_halves_round_away_from_zero():
+    # exact halves at scale 0.5, round() would give 0, -0 and 2
+    assert unpack_frame(pack_frame([0.25, -0.25, 0.75], scale=0.5), scale=0.5) == [0.5, -0.5, 1.0]
+
+def test_values_outside_the_range_are_clamped():
+    assert unpack_frame(pack_frame([400.0, -400.0])) == [327.67, -327.68]
+
+def test_packed_bytes_are_little_endian():
+    assert pack_frame([0.01, -0.01]) == b"\x01\x00\xff\xff"
+
+
+def test_frame_is_stored_packed():
+    stored = IRImage(frame=[20.5, 21.25]).to_dict()
+    assert stored == {"framePacked": Binary(pack_frame([20.5, 21.25])), "frameScale": IR_FRAME_SCALE}
+
+def test_packed_frame_is_stored_as_sent():
+    packed = pack_frame([20.5, 21.25])
+    assert IRImage(framePacked=base64.b64encode(packed).decode()).to_dict()["framePacked"] == Binary(packed)
+
+@pytest.mark.parametrize("fields", [
+    {},
+    {"frame": [20.5], "framePacked": base64.b64encode(pack_frame([20.5])).decode()},
+    {"framePacked": "not base64!"},
+    {"framePacked": base64.b64encode(b"\x01\x02\x03").decode()},
+    {"frame": [20.5, 400.0]},
+    {"frame": [float("nan")]},
+])
+def test_invalid_frames_are_rejected(fields):
+    with pytest.raises(ValidationError):
+        IRImage(**fields)
+
+
+def test_expand_packed_document():
+    doc = {"data": {"framePacked": Binary(pack_frame([20.5, 21.25])), "frameScale": IR_FRAME_SCALE}}
+    assert expand_ir_frame(doc) == {"data": {"frame": [20.5, 21.25]}}
+
+def test_expand_packed_document_without_scale_uses_the_default():
+    doc = {"data": {"framePacked": Binary(pack_frame([20.5]))}}
+    assert expand_ir_frame(doc)["data"] == {"frame": [20.5]}
+
+def test_expand_leaves_legacy_list_documents_alone():
+    doc = {"data": {"frame": [20.5, 21.25]}}
+    assert expand_ir_frame(doc) == {"data": {"frame": [20.5, 21.25]}}
+    assert expand_ir_frame({"data": {"co2": 400}}) == {"data": {"co2": 400}}
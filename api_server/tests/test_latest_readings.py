@@ -0,0 +1,58 @@
+import asyncio
+import datetime
+
+from roomsense2.mongodb import LATEST_READINGS_SKEW, MongoDBInterface, load_latest_readings, read_latest_logs
+
+BASE_TIMESTAMP = datetime.datetime(2024, 1, 1)
+
+
+# written straight to the collection, like an insert handled by another worker
+async def insert_log(mongodb_interface:MongoDBInterface, seconds:int, co2:int, device:str = "device-1"):
+    await mongodb_interface.collection("Logs").insert_one({
+        "timestamp": BASE_TIMESTAMP + datetime.timedelta(seconds=seconds),
+        "metadata": {"device": device, "sensor": "scd41"},
+        "data": {"co2": co2}
+    })
+
+
+async def test_refresh_runs_in_the_background(mongodb_interface):
+    mongodb_interface.latestReadingsRefresh = 0.05
+    await insert_log(mongodb_interface, 0, 400)
+    mongodb_interface.start_latest_readings_refresh()
+    await asyncio.sleep(0.01)
+    assert [log["data"]["co2"] for log in await read_latest_logs(mongodb_interface)] == [400]
+
+    await insert_log(mongodb_interface, 1, 500)
+    # a reload holding the lock does not hold up requests, they read the current table
+    async with mongodb_interface.latestReadingsLock:
+        assert [log["data"]["co2"] for log in await read_latest_logs(mongodb_interface)] == [400]
+    await asyncio.sleep(0.1)
+    assert [log["data"]["co2"] for log in await read_latest_logs(mongodb_interface)] == [500]
+
+    await mongodb_interface.close()
+    assert mongodb_interface.latestReadingsTask is None
+
+async def test_without_refresh_the_table_is_loaded_once(mongodb_interface):
+    mongodb_interface.start_latest_readings_refresh()
+    assert mongodb_interface.latestReadingsTask is None
+
+    await insert_log(mongodb_interface, 0, 400)
+    assert [log["data"]["co2"] for log in await read_latest_logs(mongodb_interface)] == [400]
+    await insert_log(mongodb_interface, 1, 500)
+    assert [log["data"]["co2"] for log in await read_latest_logs(mongodb_interface)] == [400]
+
+async def test_reload_merges_the_logs_since_the_previous_load(mongodb_interface):
+    await insert_log(mongodb_interface, 0, 400)
+    await load_latest_readings(mongodb_interface)
+    assert mongodb_interface.latestReadings.loadedUntil == BASE_TIMESTAMP
+
+    skew = int(LATEST_READINGS_SKEW.total_seconds())
+    await insert_log(mongodb_interface, 10, 500)
+    await insert_log(mongodb_interface, 1 - skew, 600, device="device-2")
+    await insert_log(mongodb_interface, -1 - skew, 700, device="device-3")
+    await load_latest_readings(mongodb_interface)
+
+    # device-3 only logged before the skew margin, a reload does not read it
+    readings = {log["metadata"]["device"]: log["data"]["co2"] for log in await read_latest_logs(mongodb_interface)}
+    assert readings == {"device-1": 500, "device-2": 600}
+    assert mongodb_interface.latestReadings.loadedUntil == BASE_TIMESTAMP + datetime.timedelta(seconds=10)
@@ -0,0 +1,35 @@
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+from roomsense2.metrics import CallbackMetric, Counter, Histogram, MetricsRegistry
+
+
+def test_updates_from_threads_are_not_lost():
+    counter = Counter("test_total", "test counter", ("operation",))
+    histogram = Histogram("test_seconds", "test histogram", ("operation",))
+
+    def work(_):
+        for _ in range(1000):
+            counter.inc("put_object")
+            histogram.observe(0.002, "put_object")
+
+    with ThreadPoolExecutor(8) as executor:
+        list(executor.map(work, range(8)))
+
+    assert counter.values[("put_object",)] == 8000
+    bucket_counts, total, count = histogram.values[("put_object",)]
+    assert count == 8000 and bucket_counts[-1] == 8000
+
+def test_every_sample_carries_the_worker():
+    registry = MetricsRegistry()
+    registry.register(Counter("test_total", "test counter", ("operation",))).inc("head_object")
+    registry.register(Histogram("test_seconds", "test histogram", (), (1.0,))).observe(0.5)
+    registry.register(CallbackMetric("test_entries", "test gauge", (), lambda: {(): 3}))
+
+    samples = [line for line in registry.render().splitlines() if not line.startswith("#")]
+
+    worker = f'worker="{os.getpid()}"'
+    assert f'test_total{{operation="head_object",{worker}}} 1' in samples
+    assert f'test_seconds_bucket{{{worker},le="1.0"}} 1' in samples
+    assert f"test_entries{{{worker}}} 3" in samples
+    assert all(worker in sample for sample in samples)
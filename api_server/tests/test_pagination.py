@@ -0,0 +1,66 @@
+import datetime
+
+import pytest
+from bson import ObjectId
+from pydantic import ValidationError
+
+from roomsense2.fmt import DeviceMultiRetreivalRequest, TimeseriesMultiRetreivalRequest
+from roomsense2.mongodb import MongoDBInterface, count_capped, read_paginated_device, read_paginated_logs
+from roomsense2.pagination import log_seek_filter
+
+BASE_TIMESTAMP = datetime.datetime(2024, 1, 1)
+
+
+# three logs per timestamp so page boundaries fall between documents sharing a timestamp
+async def seed_logs(mongodb_interface:MongoDBInterface, count:int):
+    documents = [{
+        "_id": ObjectId(),
+        "timestamp": BASE_TIMESTAMP + datetime.timedelta(seconds=index // 3),
+        "metadata": {"device": "device-1", "sensor": "scd41"},
+        "data": {"co2": index}
+    } for index in range(count)]
+    await mongodb_interface.collection("Logs").insert_many(documents)
+    return documents
+
+
+@pytest.mark.parametrize("model", [TimeseriesMultiRetreivalRequest, DeviceMultiRetreivalRequest])
+@pytest.mark.parametrize("limit", [0, -1])
+def test_limit_must_be_positive(model, limit):
+    with pytest.raises(ValidationError):
+        model(limit=limit)
+
+@pytest.mark.parametrize("model", [TimeseriesMultiRetreivalRequest, DeviceMultiRetreivalRequest])
+def test_cursor_must_not_be_negative(model):
+    with pytest.raises(ValidationError):
+        model(cursor=-1)
+    assert model(cursor=0).cursor == 0
+
+def test_seek_filter_bounds_the_timestamp():
+    timestamp, object_id = BASE_TIMESTAMP, ObjectId()
+    assert log_seek_filter(timestamp, object_id, "desc")["timestamp"] == {"$lte": timestamp}
+    assert log_seek_filter(timestamp, object_id, "asc")["timestamp"] == {"$gte": timestamp}
+
+@pytest.mark.parametrize("order", ["desc", "asc"])
+async def test_page_tokens_walk_every_log_once(mongodb_interface, order):
+    documents = await seed_logs(mongodb_interface, 20)
+    seen = list()
+    token = None
+    while True:
+        page = await read_paginated_logs(mongodb_interface, TimeseriesMultiRetreivalRequest(limit=4, order=order, pageToken=token))
+        seen += [log["data"]["co2"] for log in page["data"]]
+        token = page["nextPageToken"]
+        if token is None:
+            break
+    expected = sorted(documents, key=lambda document: (document["timestamp"], document["_id"]), reverse=order == "desc")
+    assert seen == [document["data"]["co2"] for document in expected]
+
+async def test_empty_page_has_no_token(mongodb_interface):
+    logs = await read_paginated_logs(mongodb_interface, TimeseriesMultiRetreivalRequest(device="unknown"))
+    devices = await read_paginated_device(mongodb_interface, DeviceMultiRetreivalRequest(device="unknown"))
+    assert logs["data"] == [] and logs["nextPageToken"] is None
+    assert devices["data"] == [] and devices["nextPageToken"] is None
+
+@pytest.mark.parametrize("count, expected", [(4, (4, False)), (5, (5, False)), (6, (5, True))])
+async def test_count_is_only_capped_past_the_limit(mongodb_interface, count, expected):
+    await seed_logs(mongodb_interface, count)
+    assert await count_capped(mongodb_interface, "Logs", {"metadata.device": "device-1"}, 5) == expected
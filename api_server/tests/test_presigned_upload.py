@@ -0,0 +1,67 @@
+import asyncio
+import base64
+import hashlib
+from urllib.parse import parse_qs, urlparse
+
+import pytest
+import requests
+from moto import mock_aws
+
+from roomsense2.errors import ItemNotFoundError, UploadFailError
+from roomsense2.media import MediaIndex
+from roomsense2.s3 import S3Interface, finalize_s3_upload, presign_s3_upload
+
+BUCKET = "roomsense2-test"
+REGION = "ap-southeast-1"
+
+
+@pytest.fixture
+def s3_interface(mongodb_interface):
+    with mock_aws():
+        s3_interface = S3Interface("test", "test", REGION)
+        s3_interface.client.create_bucket(Bucket=BUCKET, CreateBucketConfiguration={"LocationConstraint": REGION})
+        s3_interface.set_collection_mapping("Images", BUCKET)
+        s3_interface.set_media_index(MediaIndex(mongodb_interface))
+        yield s3_interface
+        s3_interface.close()
+
+def put_presigned(presigned:dict, body:bytes):
+    response = requests.put(presigned["url"], data=body, headers=presigned["headers"])
+    response.raise_for_status()
+
+
+async def test_presigned_url_signs_the_checksum(s3_interface):
+    digest = hashlib.sha256(b"frame").hexdigest()
+    presigned = await presign_s3_upload(s3_interface, "Images", digest, "png", "image/png")
+
+    query = parse_qs(urlparse(presigned["url"]).query)
+    assert query["X-Amz-Algorithm"] == ["AWS4-HMAC-SHA256"]
+    assert "x-amz-checksum-sha256" in query["X-Amz-SignedHeaders"][0].split(";")
+    assert presigned["headers"]["x-amz-checksum-sha256"] == base64.b64encode(bytes.fromhex(digest)).decode()
+
+async def test_presign_put_finalize_registers_the_object(s3_interface):
+    body = b"\x89PNG frame"
+    digest = hashlib.sha256(body).hexdigest()
+
+    presigned = await presign_s3_upload(s3_interface, "Images", digest, "png", "image/png")
+    assert presigned["exists"] is False
+    await asyncio.get_running_loop().run_in_executor(None, put_presigned, presigned, body)
+    link = await finalize_s3_upload(s3_interface, "Images", digest, "png")
+    assert link == presigned["link"]
+    assert await s3_interface.mediaIndex.lookup(BUCKET, f"{digest}.png") == link
+    again = await presign_s3_upload(s3_interface, "Images", digest, "png", "image/png")
+    assert again["exists"] is True
+
+async def test_finalize_rejects_a_body_that_does_not_match_the_digest(s3_interface):
+    digest = hashlib.sha256(b"expected frame").hexdigest()
+
+    presigned = await presign_s3_upload(s3_interface, "Images", digest, "png", "image/png")
+    await asyncio.get_running_loop().run_in_executor(None, put_presigned, presigned, b"some other bytes")
+    with pytest.raises(UploadFailError):
+        await finalize_s3_upload(s3_interface, "Images", digest, "png")
+    assert await s3_interface.mediaIndex.lookup(BUCKET, f"{digest}.png") is None
+
+async def test_finalize_without_upload_is_not_found(s3_interface):
+    digest = hashlib.sha256(b"never uploaded").hexdigest()
+    with pytest.raises(ItemNotFoundError):
+        await finalize_s3_upload(s3_interface, "Images", digest, "png")
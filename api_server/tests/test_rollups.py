@@ -0,0 +1,102 @@
+import asyncio
+import datetime
+
+import pytest
+
+from roomsense2.common_types import TimeseriesLog
+from roomsense2.mongodb import INGEST_PROFILE, insert_log
+from roomsense2.rollups import bucket_start, rollup_updates, select_rollup
+
+TIMESTAMP = datetime.datetime(2024, 3, 1, 8, 42, 17, 250000)
+
+
+def log(timestamp:datetime.datetime, co2:float, device:str = "device-1"):
+    return {"timestamp": timestamp, "metadata": {"device": device, "sensor": "s8"}, "data": {"co2": co2, "humidity": 40, "temperature": 21}}
+
+# rollup key -> the update lists of its bulk writes, recorded instead of applied
+def record_bulk_writes(mongodb_interface):
+    writes = dict()
+    for key in ("RollupsMinute", "RollupsHour", "RollupsDay"):
+        async def bulk_write(updates, ordered = True, key = key):
+            writes.setdefault(key, list()).append(updates)
+        mongodb_interface.collection(key, INGEST_PROFILE).bulk_write = bulk_write
+    return writes
+
+
+@pytest.mark.parametrize("unit, expected", [
+    ("minute", datetime.datetime(2024, 3, 1, 8, 42)),
+    ("hour", datetime.datetime(2024, 3, 1, 8)),
+    ("day", datetime.datetime(2024, 3, 1)),
+])
+def test_bucket_start_truncates_to_the_unit(unit, expected):
+    assert bucket_start(TIMESTAMP, unit) == expected
+
+def test_bucket_start_converts_aware_timestamps_to_naive_utc():
+    aware = datetime.datetime(2024, 3, 1, 1, 30, tzinfo=datetime.timezone(datetime.timedelta(hours=2)))
+    assert bucket_start(aware, "day") == datetime.datetime(2024, 2, 29)
+
+@pytest.mark.parametrize("unit, expected", [
+    ("second", None),
+    ("minute", ("RollupsMinute", "minute")),
+    ("hour", ("RollupsHour", "hour")),
+    ("week", ("RollupsDay", "day")),
+    ("year", ("RollupsDay", "day")),
+])
+def test_select_rollup_picks_the_coarsest_fitting_collection(unit, expected):
+    assert select_rollup(unit) == expected
+
+def test_rollup_updates_combine_documents_per_bucket():
+    documents = [
+        log(TIMESTAMP, 400),
+        log(TIMESTAMP + datetime.timedelta(seconds=10), 600),
+        log(TIMESTAMP + datetime.timedelta(minutes=1), 500),
+        log(TIMESTAMP, 900, device="device-2"),
+        {"timestamp": TIMESTAMP, "metadata": {"device": "device-1", "sensor": "camera"}, "data": {"image": "s3://frame.png"}},
+    ]
+    updates = {(update._filter["device"], update._filter["start"]): update._doc for update in rollup_updates(documents, "minute")}
+
+    assert len(updates) == 3
+    first = updates[("device-1", datetime.datetime(2024, 3, 1, 8, 42))]
+    assert first["$inc"]["count.co2"] == 2 and first["$inc"]["sum.co2"] == 1000
+    assert first["$min"]["min.co2"] == 400 and first["$max"]["max.co2"] == 600
+    assert updates[("device-1", datetime.datetime(2024, 3, 1, 8, 43))]["$inc"]["count.co2"] == 1
+
+
+async def test_buffer_merges_requests_into_one_write_per_collection(mongodb_interface):
+    writes = record_bulk_writes(mongodb_interface)
+    mongodb_interface.enable_rollups(max_buckets=100, max_delay=0.05)
+    for offset, co2 in enumerate([400, 500, 600]):
+        await insert_log(mongodb_interface, TimeseriesLog.model_validate(log(TIMESTAMP + datetime.timedelta(seconds=offset), co2)))
+    assert writes == dict()
+
+    await asyncio.sleep(0.1)
+    assert sorted(writes) == ["RollupsDay", "RollupsHour", "RollupsMinute"]
+    assert all(len(calls) == 1 and len(calls[0]) == 1 for calls in writes.values())
+    update = writes["RollupsMinute"][0][0]._doc
+    assert update["$inc"]["count.co2"] == 3 and update["$inc"]["sum.co2"] == 1500
+    assert update["$min"]["min.co2"] == 400 and update["$max"]["max.co2"] == 600
+
+async def test_full_buffer_waits_for_the_write_in_flight(mongodb_interface):
+    writes = record_bulk_writes(mongodb_interface)
+    mongodb_interface.enable_rollups(max_buckets=3, max_delay=60)
+    buffer = mongodb_interface.rollupBuffer
+    release = asyncio.Event()
+    write = buffer._write
+
+    async def slow_write(batch):
+        await release.wait()
+        await write(batch)
+
+    buffer._write = slow_write
+    # one log fills a bucket in each of the three rollup collections, i.e. the buffer
+    await buffer.add([log(TIMESTAMP, 400)])
+    assert buffer.writing is not None and buffer.size() == 0
+
+    blocked = asyncio.create_task(buffer.add([log(TIMESTAMP + datetime.timedelta(days=1), 500)]))
+    await asyncio.sleep(0.01)
+    assert not blocked.done()
+
+    release.set()
+    await blocked
+    await mongodb_interface.close()
+    assert len(writes["RollupsDay"]) == 2
@@ -0,0 +1,20 @@
+import datetime
+import json
+
+from bson import ObjectId
+
+from roomsense2.serialization import bson_to_json, encode_json, naive_utc
+
+
+def test_timestamps_keep_the_naive_rendering():
+    document = {"_id": ObjectId("65920080000000000000000a"), "timestamp": datetime.datetime(2024, 1, 1)}
+    assert bson_to_json(document) == {"_id": "65920080000000000000000a", "timestamp": "2024-01-01 00:00:00"}
+
+def test_non_finite_floats_are_encoded_as_null():
+    assert json.loads(encode_json({"co2": float("nan"), "humidity": float("inf")})) == {"co2": None, "humidity": None}
+
+def test_naive_utc_converts_aware_timestamps_only():
+    naive = datetime.datetime(2024, 3, 1, 8, 0)
+    assert naive_utc(naive) is naive
+    aware = datetime.datetime(2024, 3, 1, 10, 0, tzinfo=datetime.timezone(datetime.timedelta(hours=2)))
+    assert naive_utc(aware) == naive and naive_utc(aware).tzinfo is None